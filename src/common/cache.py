@@ -0,0 +1,243 @@
+"""
+    cache.py
+    module contains PersistentCache class, SQLite key/value store shared by all runs, and caches built on it
+    ValidatorCache - ETag/Last-Modified per url used for conditional requests
+    AvailabilityCache - probe results of files on portal
+    SessionCache - encrypted cookies of authenticated sessions, requires optional 'cryptography' package
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+from common.download_exceptions import DownloadException
+from configs.config import Config, Singleton
+
+
+class PersistentCache:
+    """
+    PersistentCache stores JSON values by key in '<cache-dir>/cache.sqlite', cache-dir is configured in cache-config
+        and could be overridden by FILE_DOWNLOADER_CACHE_DIR environment variable. Each cache has own namespace,
+        entries could have time to live in seconds
+    """
+    FILE_NAME = 'cache.sqlite'
+    CACHE_DIR_ENV = 'FILE_DOWNLOADER_CACHE_DIR'
+
+    def __init__(self, namespace):
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        cache_dir = os.environ.get(self.CACHE_DIR_ENV) or Config().cache_config['cache-dir']
+        cache_dir = os.path.expanduser(cache_dir)
+        self._cache_dir = cache_dir
+        try:
+            pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(cache_dir, self.FILE_NAME), timeout=30,
+                                               check_same_thread=False)
+            with self._connection:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS cache (namespace TEXT, cache_key TEXT, '
+                                         'cache_value TEXT, expires_at REAL, PRIMARY KEY (namespace, cache_key))')
+        except Exception as e:
+            raise DownloadException('9000_UNEXPECTED_ERROR', e, f'Cache {namespace} is not available') from None
+
+    def get(self, key, default=None):
+        """
+        :param key: cache key
+        :param default: returned when key is not cached or expired
+        :return: cached value
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT cache_value, expires_at FROM cache WHERE namespace = ? '
+                                           'AND cache_key = ?', (self._namespace, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key: cache key
+        :param value: JSON serializable value
+        :param ttl: time to live in seconds, None to keep the value until it is replaced or deleted
+        :return: None
+        """
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                                     (self._namespace, key, json.dumps(value), expires_at))
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM cache WHERE namespace = ? AND cache_key = ?',
+                                     (self._namespace, key))
+
+
+class ValidatorCache(PersistentCache, metaclass=Singleton):
+    """
+    ValidatorCache keeps ETag and Last-Modified of the last successful response for each url
+        conditional_headers() : If-None-Match/If-Modified-Since headers for url, server responds 304 for unchanged file
+        store() : stores validators from response headers
+    """
+
+    def __init__(self):
+        super().__init__('validators')
+
+    def conditional_headers(self, url):
+        """
+        :param url: url
+        :return: conditional request headers, empty when url validators are not cached
+        """
+        return self.headers(self.get(url, {}))
+
+    @staticmethod
+    def headers(validators):
+        """
+        :param validators: dictionary with etag and last_modified (cached validators or download manifest row)
+        :return: If-None-Match/If-Modified-Since headers of available validators
+        """
+        headers = dict()
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def store(self, url, response_headers):
+        """
+        :param url: url
+        :param response_headers: headers of successful response
+        :return: None
+        """
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if etag or last_modified:
+            self.set(url, {'etag': etag, 'last_modified': last_modified})
+
+
+class AvailabilityCache(PersistentCache, metaclass=Singleton):
+    """
+    AvailabilityCache keeps probe results of files on portal (FM monthly files), existing files are cached without
+        expiry, missing files are cached for 'negative-ttl' seconds from cache-config 'availability' settings
+    """
+
+    def __init__(self):
+        super().__init__('availability')
+        self._negative_ttl = Config().cache_config.get('availability', {}).get('negative-ttl', 6 * 60 * 60)
+
+    def store(self, url, probe_dict, exists):
+        """
+        :param url: file url
+        :param probe_dict: probe result as dictionary
+        :param exists: file exists on portal
+        :return: None
+        """
+        self.set(url, probe_dict, None if exists else self._negative_ttl)
+
+
+class DealCache(PersistentCache, metaclass=Singleton):
+    """
+    DealCache keeps deal number and deal name of Bony deal found by CUSIP search, deal number of a deal does not change
+        so cached deals skip the search request. Entries expire after 'ttl' seconds from cache-config 'deals' settings
+        (default no expiry) and are deleted when deal reports request of cached deal fails
+    """
+
+    def __init__(self):
+        super().__init__('bony-deals')
+        self._ttl = Config().cache_config.get('deals', {}).get('ttl')
+
+    def store(self, cusip, deal_number, deal_name):
+        """
+        :param cusip: searched CUSIP
+        :param deal_number: deal number (hd_deal_number) of the deal
+        :param deal_name: deal name from deal reports page
+        :return: None
+        """
+        self.set(cusip, {'deal_number': deal_number, 'deal_name': deal_name}, self._ttl)
+
+
+class SessionCache(PersistentCache, metaclass=Singleton):
+    """
+    SessionCache keeps cookies of authenticated sessions between runs, cookies are encrypted with Fernet key from
+        FILE_DOWNLOADER_SESSION_KEY environment variable or from '<cache-dir>/session.key' (created with 0600 mode).
+        Cache is disabled when 'cryptography' package is not installed
+        load() : cookies of cached session, None when session is not cached, expired or could not be decrypted
+        save() : stores session cookies for ttl seconds
+    """
+    KEY_ENV = 'FILE_DOWNLOADER_SESSION_KEY'
+    KEY_FILE = 'session.key'
+
+    def __init__(self):
+        super().__init__('sessions')
+        self._fernet = None
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            logging.info('Session cache disabled, cryptography package is not installed')
+        else:
+            self._fernet = Fernet(os.environ.get(self.KEY_ENV) or self._key_from_file(Fernet.generate_key))
+
+    @property
+    def enabled(self):
+        return self._fernet is not None
+
+    def _key_from_file(self, generate_key):
+        key_file = os.path.join(self._cache_dir, self.KEY_FILE)
+        try:
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(key_file, 'rb') as f:
+                return f.read().strip()
+        key = generate_key()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        return key
+
+    def load(self, key):
+        """
+        :param key: session key, provider with credentials hash
+        :return: list of cookie dictionaries
+        """
+        token = self.get(key) if self.enabled else None
+        if token is None:
+            return None
+        from cryptography.fernet import InvalidToken
+        try:
+            return json.loads(self._fernet.decrypt(token.encode()))
+        except InvalidToken:
+            logging.info(f'Cached session {key} could not be decrypted, removed from cache')
+            self.delete(key)
+            return None
+
+    def save(self, key, cookies, ttl):
+        """
+        :param key: session key, provider with credentials hash
+        :param cookies: list of cookie dictionaries
+        :param ttl: time to live in seconds
+        :return: None
+        """
+        if self.enabled:
+            self.set(key, self._fernet.encrypt(json.dumps(cookies).encode()).decode(), ttl)
+
+    @staticmethod
+    def cookie_list(cookie_jar):
+        """
+        :param cookie_jar: session cookies
+        :return: list of cookie dictionaries, domain and path are kept
+        """
+        return [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure,
+                 'expires': c.expires} for c in cookie_jar]
+
+    @staticmethod
+    def restore_cookies(cookie_jar, cookies):
+        """
+        :param cookie_jar: session cookies
+        :param cookies: list of cookie dictionaries from cookie_list()
+        :return: None
+        """
+        for c in cookies:
+            cookie_jar.set(c['name'], c['value'], domain=c['domain'], path=c['path'], secure=c['secure'],
+                           expires=c['expires'])
@@ -0,0 +1,126 @@
+"""
+    concurrency.py
+    module contains ConcurrencyController class, AIMD (additive increase, multiplicative decrease) limit of concurrent
+    requests of one provider driven by observed latency and errors
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from common.cache import PersistentCache
+
+
+class ConcurrencyController:
+    """
+    ConcurrencyController of provider, configured by provider 'concurrency' settings in access-config
+        Limit grows by one after 'limit' healthy responses and is halved (at most once per 'cooldown' seconds) on 429,
+        5xx, timeout, connection error or when p95 latency of last 'window' responses rises above 'latency-tolerance'
+        times the baseline p95. Baseline follows lower p95 at once and higher p95 by 'baseline-decay' fraction of the
+        difference, so one fast run does not hold the limit down. Limit and baseline are persisted in
+        PersistentCache('concurrency'), next run starts warm
+        for_provider() : controller of provider, None when provider has no 'concurrency' settings
+        slot() : waits until number of in-flight jobs is below the limit
+        record() : feeds latency and outcome of one request
+        save() : persists current limit
+    """
+    # Defaults for provider 'concurrency' settings in access-config
+    CONCURRENCY_DEFAULTS = {'min': 1, 'max': 8, 'window': 20, 'latency-tolerance': 2.0, 'cooldown': 1,
+                            'baseline-decay': 0.05}
+    _controllers = dict()
+    _controllers_lock = threading.Lock()
+
+    def __init__(self, provider, concurrency_config, initial):
+        """
+        :param provider: provider
+        :param concurrency_config: provider 'concurrency' settings
+        :param initial: limit used when provider limit is not persisted
+        """
+        self.provider = provider
+        self.config = {**self.CONCURRENCY_DEFAULTS, **concurrency_config}
+        self._cache = PersistentCache('concurrency')
+        saved = self._cache.get(provider, {})
+        self._limit = self._bounded(saved.get('limit', initial))
+        self._baseline_p95 = saved.get('p95')
+        self._latencies = collections.deque(maxlen=self.config['window'])
+        self._decreased_at = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def for_provider(cls, provider, access_config, initial=1):
+        """
+        :param provider: provider
+        :param access_config: provider access-config
+        :param initial: limit used when provider limit is not persisted
+        :return: ConcurrencyController shared by all steps of provider, None without 'concurrency' settings
+        """
+        if not provider or 'concurrency' not in access_config:
+            return None
+        with cls._controllers_lock:
+            if provider not in cls._controllers:
+                cls._controllers[provider] = cls(provider, access_config['concurrency'], initial)
+            return cls._controllers[provider]
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def max_limit(self):
+        return self.config['max']
+
+    def _bounded(self, limit):
+        return min(self.config['max'], max(self.config['min'], limit))
+
+    @contextlib.contextmanager
+    def slot(self):
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, latency, healthy):
+        """
+        :param latency: seconds until response headers (or failure) of one request
+        :param healthy: False for 429, 5xx, timeout or connection error
+        :return: None
+        """
+        with self._condition:
+            self._latencies.append(latency)
+            if healthy and not self._latency_rising():
+                self._limit = self._bounded(self._limit + 1 / self._limit)
+            elif time.monotonic() - self._decreased_at > self.config['cooldown']:
+                self._decreased_at = time.monotonic()
+                self._limit = self._bounded(self._limit / 2)
+                self._latencies.clear()
+                logging.info(f'{self.provider} concurrency reduced to {self.limit}')
+            self._condition.notify_all()
+
+    def _latency_rising(self):
+        if len(self._latencies) < self._latencies.maxlen:
+            return False
+        latencies = sorted(self._latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        if self._baseline_p95 is None or p95 < self._baseline_p95:
+            self._baseline_p95 = p95
+        else:
+            self._baseline_p95 += (p95 - self._baseline_p95) * self.config['baseline-decay']
+        return p95 > self._baseline_p95 * self.config['latency-tolerance']
+
+    def save(self):
+        """
+        :return: None
+        """
+        with self._condition:
+            self._cache.set(self.provider, {'limit': self._limit, 'p95': self._baseline_p95})
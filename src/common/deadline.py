@@ -0,0 +1,55 @@
+"""
+    deadline.py
+    module contains Deadline class, overall time limit of profile or provider run
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import time
+
+from common.download_exceptions import DownloadException
+
+
+class Deadline:
+    """
+    Deadline is shared by all steps (and all providers of profile) of one run, it is checked before each step,
+        request and downloaded chunk. Request timeouts never exceed the remaining time
+        check() : raises DownloadException 9001 when deadline is exceeded
+        timeout() : (connect, read) timeout capped by remaining time
+    """
+    # smallest timeout passed to requests, zero timeout is not allowed
+    MIN_TIMEOUT = 0.001
+
+    def __init__(self, seconds):
+        """
+        :param seconds: time limit in seconds from now
+        """
+        self.seconds = seconds
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """
+        :return: seconds left, 0 when deadline is exceeded
+        """
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() == 0
+
+    def check(self, step):
+        """
+        :param step: step or request about to start, used in error message
+        :return: None
+        """
+        if self.expired:
+            raise DownloadException('9001_DEADLINE_EXCEEDED',
+                                    custom_message=f'Deadline of {self.seconds} seconds exceeded :: {step}')
+
+    def timeout(self, timeout):
+        """
+        :param timeout: (connect, read) timeout in seconds
+        :return: timeout capped by remaining time
+        """
+        remaining = max(self.remaining(), self.MIN_TIMEOUT)
+        return tuple(min(t, remaining) for t in timeout)
@@ -45,11 +45,13 @@ exception_messages = {
     '1002_INVALID_TIME_SPAN_FORMAT': 'Time span format is not correct, it should be either latest(text), mm/yyyy or mm/yyyy-mm/yyyy',
     '2000_AUTHENTICATION_FAILED': 'Authentication failed',
     '3000_ACCESS_FAILED': 'Access failed',
+    '3001_CIRCUIT_OPEN': 'Portal is not responding, requests are stopped',
     '4000_PARSING_FAILED': 'Parsing failed',
     '5000_FILTER_FAILED': 'Filter failed',
     '6000_FILE_DOWNLOAD_FAILED': 'File Download failed',
     '6001_FILE_DOWNLOAD_NO_FILE': 'Files are not available for download',
     '7000_FILE_TRANSFER_FAILED': 'File Transfer failed',
     '8000_UTIL_METHOD_FAILED': 'Utils method call failed',
-    '9000_UNEXPECTED_ERROR': 'Something went wrong'
+    '9000_UNEXPECTED_ERROR': 'Something went wrong',
+    '9001_DEADLINE_EXCEEDED': 'Run deadline exceeded'
 }
@@ -0,0 +1,82 @@
+"""
+    filter_index.py
+    module contains FilterIndex class, index of download urls by month and filter terms used by FileDownloader.filter
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import bisect
+import re
+
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10,
+          'Nov': 11, 'Dec': 12}
+# 'Mon YYYY' as written to search_data by the parsers
+MONTH_PATTERN = re.compile(r'(' + '|'.join(MONTHS) + r') (\d{4})')
+
+
+class FilterIndex:
+    """
+    FilterIndex is built once over download urls of access url
+        Filter terms (user-input-config 'filters') are matched in one pass over search_data with a single regex of
+        all terms, url is indexed only when search_data has all the terms
+        Months found in search_data are kept as sorted (year, month) keys with positions of matching urls
+        add() : indexes one more url, used to filter urls while pages are still parsed
+        select() : urls for list of dates, in original order
+        latest() : urls of newest month, not later than given date
+    """
+
+    def __init__(self, download_urls, filters):
+        self._download_urls = list()
+        self._terms = set(filters)
+        # longest first, so a term which is prefix of another term does not hide the longer one
+        terms = sorted(self._terms, key=len, reverse=True)
+        self._matcher = re.compile('|'.join(map(re.escape, terms))) if terms else None
+        self._months = dict()
+        self._month_keys = list()
+        for download_url in download_urls:
+            self.add(download_url)
+
+    def add(self, download_url):
+        """
+        :param download_url: DownloadUrl
+        :return: set of (year, month) keys of the url, empty set when search_data does not have all the terms
+        """
+        position = len(self._download_urls)
+        self._download_urls.append(download_url)
+        s_data = download_url.search_data or ''
+        if not self._has_all_terms(s_data):
+            return set()
+        months = {(int(year), MONTHS[month_name]) for month_name, year in MONTH_PATTERN.findall(s_data)}
+        for month in months:
+            if month not in self._months:
+                self._months[month] = list()
+                bisect.insort(self._month_keys, month)
+            self._months[month].append(position)
+        return months
+
+    def _has_all_terms(self, s_data):
+        if self._matcher is None:
+            return True
+        found = set(self._matcher.findall(s_data))
+        # terms overlapping with a longer match are not returned by findall, those are checked one by one
+        return all(term in s_data for term in self._terms - found)
+
+    def select(self, dates):
+        """
+        :param dates: list of datetime, only year and month are used
+        :return: download urls having any of the months in search_data
+        """
+        positions = set()
+        for dt in dates:
+            positions.update(self._months.get((dt.year, dt.month), []))
+        return [self._download_urls[position] for position in sorted(positions)]
+
+    def latest(self, until):
+        """
+        :param until: datetime, months after it are ignored
+        :return: download urls of newest month, empty list when no url matches
+        """
+        index = bisect.bisect_right(self._month_keys, (until.year, until.month))
+        if index == 0:
+            return []
+        return [self._download_urls[position] for position in self._months[self._month_keys[index - 1]]]
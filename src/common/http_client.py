@@ -0,0 +1,161 @@
+"""
+    http_client.py
+    module contains HttpClient class, factory of pooled requests sessions used by all downloaders and utilities
+    TimeoutHTTPAdapter class applies provider connect/read timeouts to requests sent without explicit timeout and
+        rate limit of portal host to every request
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import logging
+import socket
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from common.rate_limiter import RateLimiter
+from configs.config import Config, Singleton
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with default (connect, read) timeout, pooled connections use TCP keep-alive so idle connections to
+        portal survive between requests and TLS handshake is paid once per connection. Requests to hosts with
+        'rate-limit' wait for RateLimiter slot
+    """
+    SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        limiter = RateLimiter.for_url(request.url)
+        if limiter is None:
+            return super().send(request, **kwargs)
+        with limiter.slot():
+            response = super().send(request, **kwargs)
+        limiter.observe(response)
+        return response
+
+
+class HttpClient(metaclass=Singleton):
+    """
+    HttpClient creates requests sessions configured by provider 'http' settings in access-config
+        session() : new session for login, pre-connected session is returned when preconnect() prepared one
+        shared_session() : one session per provider shared by anonymous requests (FM downloads, probes)
+        preconnect() : opens connections to login and access url hosts in background, before provider starts
+    """
+    # Defaults for provider 'http' settings in access-config
+    HTTP_DEFAULTS = {'pool-connections': 10, 'pool-maxsize': 10, 'connect-timeout': 10, 'read-timeout': 60,
+                     'min-byte-rate': 0, 'byte-rate-grace': 30, 'keep-alive': True, 'preconnect': False}
+
+    def __init__(self):
+        self._configs = Config()
+        self._lock = threading.Lock()
+        self._shared_sessions = dict()
+        self._warm_sessions = dict()
+        self._executor = None
+
+    def http_config(self, provider=None):
+        """
+        :param provider: provider, None for defaults
+        :return: HTTP_DEFAULTS updated with provider 'http' settings, pool is not smaller than download plus access
+            max-workers, downloads start while deal pages are requested in stream mode
+        """
+        access_config = self._configs.access_config.get(provider, {}) if provider else {}
+        http_config = {**self.HTTP_DEFAULTS, **access_config.get('http', {})}
+        max_workers = access_config.get('download', {}).get('max-workers', 1) + \
+            access_config.get('access', {}).get('max-workers', 1)
+        http_config['pool-maxsize'] = max(http_config['pool-maxsize'], max_workers)
+        return http_config
+
+    def session(self, provider=None):
+        """
+        :param provider: provider
+        :return: requests session, caller closes it
+        """
+        with self._lock:
+            warm = self._warm_sessions.pop(provider, None)
+        return warm.result() if warm else self._new_session(provider)
+
+    def shared_session(self, provider=None):
+        """
+        :param provider: provider
+        :return: requests session shared by threads of the run, closed by close()
+        """
+        with self._lock:
+            if provider not in self._shared_sessions:
+                self._shared_sessions[provider] = self._new_session(provider)
+            return self._shared_sessions[provider]
+
+    def _new_session(self, provider):
+        http_config = self.http_config(provider)
+        session = requests.Session()
+        adapter = TimeoutHTTPAdapter((http_config['connect-timeout'], http_config['read-timeout']),
+                                     pool_connections=http_config['pool-connections'],
+                                     pool_maxsize=http_config['pool-maxsize'])
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not http_config['keep-alive']:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def preconnect(self, providers):
+        """
+        open connections of providers with 'preconnect' setting, login session or shared session (no login) is
+            prepared in background and picked up by session()/shared_session()
+        :param providers: list of providers
+        :return: None
+        """
+        for provider in providers:
+            if not self.http_config(provider)['preconnect']:
+                continue
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='preconnect')
+                if self._configs.auth_config.get(provider):
+                    if provider not in self._warm_sessions:
+                        self._warm_sessions[provider] = self._executor.submit(self._connect, provider,
+                                                                              self._new_session(provider))
+                    continue
+            self._executor.submit(self._connect, provider, self.shared_session(provider))
+
+    def _connect(self, provider, session):
+        access_config = self._configs.access_config[provider]
+        urls = [access_config.get('login-url')] + [a_url['url'] for a_url in access_config['access-url']]
+        hosts = {urllib.parse.urlsplit(url)._replace(path='/', query='', fragment='').geturl() for url in urls if url}
+        for host in hosts:
+            try:
+                session.head(host).close()
+            except Exception as e:
+                logging.debug(f'Pre-connection to {host} failed :: {e}')
+        return session
+
+    def close(self):
+        """
+        close shared and unused pre-connected sessions, shut down preconnect threads
+        :return: None
+        """
+        with self._lock:
+            sessions = list(self._shared_sessions.values())
+            warm_sessions = list(self._warm_sessions.values())
+            self._shared_sessions.clear()
+            self._warm_sessions.clear()
+            executor, self._executor = self._executor, None
+        for warm in warm_sessions:
+            sessions.append(warm.result())
+        if executor:
+            executor.shutdown(wait=False)
+        for session in sessions:
+            session.close()
@@ -0,0 +1,100 @@
+"""
+    manifest.py
+    module contains DownloadManifest class, persistent record of downloaded files used to skip files
+    already downloaded by previous runs
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+
+from common.download_exceptions import DownloadException
+
+
+class DownloadManifest:
+    """
+    DownloadManifest stores one row per downloaded file in SQLite database kept in output directory
+        Row is identified by provider + file_url + request params + search_data and has out_file, size, checksum,
+        validators (ETag/Last-Modified) and download timestamp
+        downloaded() : manifest row of file still present on disk, its validators revalidate the file with portal
+        record() : inserts or replaces manifest row after successful download
+    """
+    FILE_NAME = '.download-manifest.sqlite'
+
+    def __init__(self, out_dir, volatile_params=()):
+        """
+        :param out_dir: output directory, manifest database is created in this directory
+        :param volatile_params: request params which change from run to run (Ex. csrfKey), excluded from the key
+        """
+        self._volatile_params = set(volatile_params)
+        self._lock = threading.Lock()
+        try:
+            pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(out_dir, self.FILE_NAME), timeout=30,
+                                               check_same_thread=False)
+            with self._connection:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS manifest (item_key TEXT PRIMARY KEY, '
+                                         'provider TEXT, file_url TEXT, out_file TEXT, size INTEGER, checksum TEXT, '
+                                         'etag TEXT, last_modified TEXT, downloaded_at TEXT)')
+        except Exception as e:
+            raise DownloadException('9000_UNEXPECTED_ERROR', e, 'Download manifest is not available') from None
+
+    def item_key(self, provider, download_url):
+        """
+        key of the manifest row
+        :param provider: provider
+        :param download_url: DownloadUrl
+        :return: sha256 hex digest
+        """
+        params = {k: v for k, v in (download_url.params or {}).items() if k not in self._volatile_params}
+        key_data = json.dumps([provider, download_url.file_url, params, download_url.search_data], sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, provider, download_url):
+        """
+        :param provider: provider
+        :param download_url: DownloadUrl
+        :return: manifest row as dictionary or None
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT out_file, size, checksum, etag, last_modified, downloaded_at '
+                                              'FROM manifest WHERE item_key = ?',
+                                              (self.item_key(provider, download_url),))
+            row = cursor.fetchone()
+        if row:
+            return dict(zip(['out_file', 'size', 'checksum', 'etag', 'last_modified', 'downloaded_at'], row))
+        return None
+
+    def downloaded(self, provider, download_url, out_file):
+        """
+        file is downloaded when manifest has a row for it and same size file is present at out_file
+        :param provider: provider
+        :param download_url: DownloadUrl
+        :param out_file: output file path
+        :return: manifest row as dictionary or None
+        """
+        entry = self.get(provider, download_url)
+        if entry is not None and entry['out_file'] == out_file and os.path.isfile(out_file) \
+                and os.path.getsize(out_file) == entry['size']:
+            return entry
+        return None
+
+    def record(self, provider, download_url, out_file, size, checksum, etag=None, last_modified=None):
+        """
+        insert or replace manifest row of downloaded file
+        :return: None
+        """
+        row = (self.item_key(provider, download_url), provider, download_url.file_url, out_file, size, checksum,
+               etag, last_modified, datetime.datetime.now().isoformat())
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,61 @@
+"""
+    probe.py
+    module contains Prober class to check file availability on portal without downloading the file
+    ProbeResult class is named tuple, it has url, exists, status_code and validators/size of the file, exists is None
+    when portal did not tell whether file exists (Ex. 503 after all retry attempts)
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+from collections import namedtuple
+
+from common.cache import ValidatorCache
+from common.http_client import HttpClient
+from common.retry import RetryPolicy
+from configs.config import Config
+
+ProbeResult = namedtuple('ProbeResult', ['url', 'exists', 'status_code', 'etag', 'last_modified', 'content_length'])
+
+
+class Prober:
+    """
+    Prober sends HEAD request over pooled session of provider, for servers which reject HEAD (405/501) it sends GET for the
+        first byte only ('Range: bytes=0-0'). Probe is conditional with validators of the last download, so 304 (Not
+        Modified) means file exists and downloaded copy is current. Requests are retried by RetryPolicy, only 404/410
+        mean that file is missing
+    """
+    HEAD_REJECTED = (405, 501)
+    EXISTS = (200, 206, 304)
+    MISSING = (404, 410)
+
+    def __init__(self, session=None, retry=None, provider=None):
+        """
+        :param session: requests session, default shared pooled session of provider
+        :param retry: RetryPolicy of probe requests, default RetryPolicy of provider 'retry' settings
+        :param provider: provider, its 'http' and 'retry' settings in access-config are used
+        """
+        retry_config = Config().access_config.get(provider, {}).get('retry') if provider else None
+        self._session = session if session else HttpClient().shared_session(provider)
+        self._retry = retry if retry else RetryPolicy(retry_config)
+
+    def probe(self, url):
+        """
+        :param url: file url
+        :return: ProbeResult
+        """
+        headers = ValidatorCache().conditional_headers(url)
+        response = self._retry.call(lambda: self._session.head(url, headers=headers, allow_redirects=True), 'HEAD',
+                                    url)
+        if response.status_code in self.HEAD_REJECTED:
+            response = self._retry.call(lambda: self._session.get(url, headers={**headers, 'Range': 'bytes=0-0'},
+                                                                  stream=True), 'GET', url)
+            response.close()
+        content_length = response.headers.get('Content-Length')
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            content_length = content_range[content_range.rfind('/') + 1:].replace('*', '') or None
+        exists = True if response.status_code in self.EXISTS else False if response.status_code in self.MISSING \
+            else None
+        return ProbeResult(url, exists, response.status_code,
+                           response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                           int(content_length) if content_length else None)
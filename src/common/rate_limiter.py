@@ -0,0 +1,128 @@
+"""
+    rate_limiter.py
+    module contains RateLimiter class, token bucket and in-flight limit of requests to one portal host
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import contextlib
+import datetime
+import email.utils
+import logging
+import threading
+import time
+import urllib.parse
+
+from configs.config import Config
+
+
+class RateLimiter:
+    """
+    RateLimiter of one portal host, configured by provider 'rate-limit' settings in access-config for all hosts of the
+        provider (site, login, auth and access urls). Limiter is shared by all sessions, so access, probe and download
+        requests of all providers on the host use the same budget. Hosts without 'rate-limit' are not limited
+        for_url() : RateLimiter of url host or None
+        slot() : waits for free in-flight slot and token, slot is held until response headers are received
+        observe() : 429/503 response with Retry-After header pauses all requests to the host
+    """
+    THROTTLE_STATUSES = (429, 503)
+    _limiters = None
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, host, requests_per_second=0, burst=1, max_in_flight=0):
+        """
+        :param host: portal host
+        :param requests_per_second: token refill rate, 0 for no rate limit
+        :param burst: bucket size, requests sent at once after idle time
+        :param max_in_flight: concurrent requests, 0 for no limit
+        """
+        self.host = host
+        self._rate = requests_per_second
+        self._burst = max(burst, 1)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._not_before = 0
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    @classmethod
+    def for_url(cls, url):
+        """
+        :param url: request url
+        :return: RateLimiter of url host, None when host is not limited
+        """
+        with cls._limiters_lock:
+            if cls._limiters is None:
+                cls._limiters = cls._from_config(Config().access_config)
+        return cls._limiters.get(urllib.parse.urlsplit(url).netloc)
+
+    @classmethod
+    def _from_config(cls, access_config):
+        limiters = dict()
+        for provider, provider_config in access_config.items():
+            rate_config = provider_config.get('rate-limit')
+            if not rate_config:
+                continue
+            urls = [provider_config.get(u) for u in ('site-url', 'login-url', 'auth-url')] + \
+                   [a_url['url'] for a_url in provider_config['access-url']]
+            for host in {urllib.parse.urlsplit(url).netloc for url in urls if url}:
+                if host not in limiters:
+                    limiters[host] = cls(host, rate_config.get('requests-per-second', 0), rate_config.get('burst', 1),
+                                         rate_config.get('max-in-flight', 0))
+        return limiters
+
+    @contextlib.contextmanager
+    def slot(self):
+        if self._in_flight:
+            self._in_flight.acquire()
+        try:
+            self._wait_token()
+            yield
+        finally:
+            if self._in_flight:
+                self._in_flight.release()
+
+    def _wait_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._rate:
+                    self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                    self._updated = now
+                wait = self._not_before - now
+                if wait <= 0:
+                    if not self._rate:
+                        return
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def observe(self, response):
+        """
+        :param response: response of the host
+        :return: None
+        """
+        if response.status_code in self.THROTTLE_STATUSES:
+            delay = self.retry_after(response.headers.get('Retry-After'))
+            if delay:
+                logging.info(f'{self.host} responded {response.status_code}, requests paused for {delay:.0f} seconds')
+                with self._lock:
+                    self._not_before = max(self._not_before, time.monotonic() + delay)
+
+    @staticmethod
+    def retry_after(value):
+        """
+        :param value: Retry-After header, seconds or http date
+        :return: seconds to wait, None when header is missing or invalid
+        """
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
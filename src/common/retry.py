@@ -0,0 +1,166 @@
+"""
+    retry.py
+    module contains RetryPolicy class, retries transient request failures with exponential backoff and jitter
+    CircuitBreaker class stops requests to a portal host after repeated failures, so a dead portal fails fast
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+from common.download_exceptions import DownloadException
+
+
+class RetryPolicy:
+    """
+    RetryPolicy is configured by provider 'retry' settings in access-config
+        call() : sends request, connection errors, timeouts and 'statuses' responses are retried 'attempts' times.
+                 Non idempotent requests (POST with one time csrfKey etc.) are retried only when connection could not be
+                 opened, request never reached the portal
+        transient() : True when failed request or download could succeed later, used for deferred retry of files
+    """
+    # Defaults for provider 'retry' settings in access-config
+    RETRY_DEFAULTS = {'attempts': 3, 'backoff': 1, 'max-backoff': 30, 'jitter': 0.5,
+                      'statuses': [429, 500, 502, 503, 504], 'idempotent-post': False, 'failure-threshold': 5,
+                      'reset-timeout': 60, 'deferred-delay': 5}
+    TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                        requests.HTTPError)
+
+    def __init__(self, retry_config=None):
+        """
+        :param retry_config: provider 'retry' settings
+        """
+        self.config = {**self.RETRY_DEFAULTS, **(retry_config if retry_config else {})}
+        self.statuses = set(self.config['statuses'])
+
+    def call(self, send, method='GET', url=None, deadline=None):
+        """
+        :param send: function sending the request, called for each attempt
+        :param method: http method, POST is idempotent only with 'idempotent-post' setting
+        :param url: request url, circuit breaker of url host is used when provided
+        :param deadline: Deadline of the run or None, no retry is started after deadline
+        :return: response, last response with retry status when all attempts failed
+        """
+        idempotent = method.upper() in ('GET', 'HEAD') or self.config['idempotent-post']
+        breaker = CircuitBreaker.for_url(url, self.config) if url else None
+        attempt = 1
+        while True:
+            if breaker:
+                breaker.before_request()
+            delay = self.delay(attempt)
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if breaker:
+                    breaker.failure()
+                if not self._retry(attempt, delay, deadline) or \
+                        not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                logging.debug(f'Attempt {attempt} of {method} {url} failed :: {e}')
+            except Exception:
+                # not a portal failure (invalid request etc.), circuit state is not changed
+                if breaker:
+                    breaker.release()
+                raise
+            else:
+                if response.status_code not in self.statuses:
+                    if breaker:
+                        breaker.success()
+                    return response
+                # 429 - portal is alive and throttling, pause by Retry-After is done by RateLimiter
+                if breaker:
+                    breaker.success() if response.status_code == 429 else breaker.failure()
+                if not idempotent or not self._retry(attempt, delay, deadline):
+                    return response
+                logging.debug(f'Attempt {attempt} of {method} {url} failed :: status {response.status_code}')
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _retry(self, attempt, delay, deadline):
+        return attempt < self.config['attempts'] and not (deadline and deadline.remaining() < delay)
+
+    def delay(self, attempt):
+        """
+        :param attempt: number of failed attempt
+        :return: exponential backoff in seconds with random jitter, capped by 'max-backoff'
+        """
+        backoff = min(self.config['max-backoff'], self.config['backoff'] * 2 ** (attempt - 1))
+        return backoff * (1 + random.uniform(-self.config['jitter'], self.config['jitter']))
+
+    @classmethod
+    def transient(cls, error):
+        """
+        :param error: exception raised for request or download, DownloadException causes are checked
+        :return: True when error is connection failure, timeout, broken transfer or retry status
+        """
+        while isinstance(error, DownloadException) and error.exception_code == '6000_FILE_DOWNLOAD_FAILED':
+            error = error.cause
+        return isinstance(error, cls.TRANSIENT_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker of one portal host, shared by all providers and threads of the run
+        closed - requests are sent, 'failure-threshold' consecutive failures open the circuit
+        open - requests fail with DownloadException 3001 until 'reset-timeout' seconds pass
+        half open - one trial request is sent, success closes the circuit and failure opens it again
+    """
+    _breakers = dict()
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, host, failure_threshold, reset_timeout):
+        self.host = host
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @classmethod
+    def for_url(cls, url, retry_config):
+        """
+        :param url: request url
+        :param retry_config: provider 'retry' settings with 'failure-threshold' and 'reset-timeout'
+        :return: CircuitBreaker of url host
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with cls._breakers_lock:
+            if host not in cls._breakers:
+                cls._breakers[host] = cls(host, retry_config['failure-threshold'], retry_config['reset-timeout'])
+            return cls._breakers[host]
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._trial or time.monotonic() - self._opened_at < self._reset_timeout:
+                raise DownloadException('3001_CIRCUIT_OPEN', custom_message=f'Requests to {self.host} are stopped '
+                                                                            f'after {self._failures} failures')
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release(self):
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self._failure_threshold:
+                if self._opened_at is None or self._trial:
+                    logging.info(f'Circuit opened for {self.host} after {self._failures} failures')
+                self._opened_at = time.monotonic()
+                self._trial = False
@@ -0,0 +1,61 @@
+"""
+    session_registry.py
+    module contains SessionRegistry class, authenticated sessions shared by providers of one run
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import copy
+import logging
+import threading
+
+
+class SessionRegistry:
+    """
+    SessionRegistry shares one authenticated session between providers which login to the same portal with the same
+        credentials (Ex. wf-wffm, wf-ry and wf-wfeu), providers of a profile run concurrently so registry is thread safe
+        acquire() : returns registered session or logs in once, other providers with same key wait for the login
+        close() : closes all sessions after all providers of the profile are processed
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+
+    def acquire(self, key, login, close=None):
+        """
+        :param key: session key, login/auth hosts with credentials hash
+        :param login: function returning (session, response_dict), called until login of the key succeeds
+        :param close: function closing the session, default session.close()
+        :return: shared session and copy of response_dict
+        """
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+        with entry.lock:
+            if entry.session is None:
+                entry.session, entry.response_dict = login()
+                entry.close = close
+            else:
+                logging.debug(f'Reusing session {key} of this run')
+        return entry.session, copy.deepcopy(entry.response_dict)
+
+    def close(self):
+        """
+        :return: None
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if entry.session is not None:
+                entry.close(entry.session) if entry.close else entry.session.close()
+
+
+class _Entry:
+    """registered session, lock serializes login to the same portal"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.response_dict = None
+        self.close = None
@@ -1,27 +1,33 @@
 """
     utils.py
     Utils class provided the utility functions for string, date and other common operations
-    DownloadUrl class is named tuple, it has file_url, out_dir and search_data variables
+    DownloadUrl class is named tuple, it has file_url, out_dir and search_data variables, probe is ProbeResult when
+        file availability was checked before download
+    DownloadResult class is named tuple, it has download_url, out_file, status (downloaded, skipped or failed) and
+        error (None unless failed) variables
 """
+from common.cache import AvailabilityCache
+from common.probe import Prober, ProbeResult
 from src.common.download_exceptions import DownloadException
 
 __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
-import bs4
 import datetime
 from dateutil.relativedelta import relativedelta
 import ntpath
 import pathlib
-import requests
 import os
 import logging
 from collections import namedtuple
 # from common.download_exceptions import *
 import re
 
-DownloadUrl = namedtuple('DownloadUrl', ['file_url', 'out_file', 'search_data', 'report_group', 'params', 'method'])
+DownloadUrl = namedtuple('DownloadUrl', ['file_url', 'out_file', 'search_data', 'report_group', 'params', 'method',
+                                         'probe'])
 DownloadUrl.__new__.__defaults__ = (None,) * len(DownloadUrl._fields)
 
+DownloadResult = namedtuple('DownloadResult', ['download_url', 'out_file', 'status', 'error'])
+
 DealInfo = namedtuple('DealInfo', ['deal_id', 'deal_name', 'link', 'f_html'])
 
 
@@ -30,18 +36,52 @@ class Utils:
     Utils class has utility methods used in downloader modules and classes
     """
     STR_XML_ = '.xml'
+    LATEST_MONTHS_BACK = 24
 
     def format_html(self, html_str):
         """
         format html page source, BeautifulSoup makes sure formatted output source is valid for parsing
+            bs4 and html5lib are imported on first use, only providers with 'html5lib' parser need them
         :param html_str: html page source string
         :return: formatted html
         """
+        import bs4
         soup = bs4.BeautifulSoup(html_str, 'html5lib')
         f_html = soup.prettify()
         logging.debug(f'Formatted html::: {f_html}')
         return f_html
 
+    def html_tree(self, html, parser='lxml'):
+        """
+        parse page source to lxml tree
+            'lxml' - fast path, builds the tree directly from response bytes, rows of tables without tbody are moved to
+                     tbody same as html5lib does, so xpaths work for both parsers
+            'html5lib' - slow, formats the page source with format_html before parsing, for malformed page sources
+        :param html: html page source bytes or string
+        :param parser: 'lxml' or 'html5lib'
+        :return: lxml html element of the document
+        """
+        import lxml.html
+        if parser == 'html5lib':
+            return lxml.html.fromstring(self.format_html(html))
+        if not html or not html.strip():
+            html = '<html><body></body></html>'
+        tree = lxml.html.document_fromstring(html)
+        for table in tree.iter('table'):
+            self._add_tbody(table)
+        return tree
+
+    def _add_tbody(self, table):
+        tbody = None
+        for child in list(table):
+            if child.tag == 'tr':
+                if tbody is None:
+                    tbody = table.makeelement('tbody', {})
+                    child.addprevious(tbody)
+                tbody.append(child)
+            elif isinstance(child.tag, str):
+                tbody = None
+
     def date_range(self, time_span):
         """
         prepare the list of date object/s for provided time span,
@@ -68,20 +108,27 @@ class Utils:
         """
         return datetime.datetime.strptime(date_str, date_format)
 
-    def latest_url(self, a_url, out_dir, provider, latest=datetime.datetime.now()):
+    def latest_url(self, a_url, out_dir, provider, latest=None):
         """
-        This method is used only for FM
+        This method is used only for FM, probes month by month back from latest, at most LATEST_MONTHS_BACK months
         :param a_url: access url
         :param out_dir: output directory
-        :param latest: current timestamp
-        :return: latest available url on fm portal
-        """
-        f_url = a_url + latest.strftime("%b") + str(latest.year) + self.STR_XML_
-        if self.is_url_exist(f_url):
-            out_dir += '/' + str(latest.year) + '-' + str(latest.month) + '/' + provider
-            o_file = self.out_file(f_url, out_dir)
-            return DownloadUrl(f_url, o_file, '', str(latest.year) + '-' + latest.strftime("%b"))
-        return self.latest_url(a_url, out_dir, provider, latest + relativedelta(months=-1))
+        :param provider: provider
+        :param latest: timestamp to start from, default current timestamp
+        :return: latest available url on fm portal, None if no file available. Month of unknown availability (Ex. 503)
+            is returned for download stage to retry
+        """
+        latest = latest if latest else datetime.datetime.now()
+        for _ in range(self.LATEST_MONTHS_BACK):
+            f_url = a_url + latest.strftime("%b") + str(latest.year) + self.STR_XML_
+            probe = self.probe(f_url, cached=True, provider=provider)
+            if probe.exists is not False:
+                # unknown availability stops the search, older month is not the latest file
+                o_dir = out_dir + '/' + str(latest.year) + '-' + str(latest.month) + '/' + provider
+                o_file = self.out_file(f_url, o_dir)
+                return DownloadUrl(f_url, o_file, '', str(latest.year) + '-' + latest.strftime("%b"), probe=probe)
+            latest += relativedelta(months=-1)
+        return None
 
     def out_file(self, url, o_dir, p_type=None):
         """
@@ -119,14 +166,31 @@ class Utils:
 
     def is_url_exist(self, url):
         """
-        check if file exist on portal
+        check if file exist on portal, see probe
         :param url: url to verify
         :return: boolean
         """
-        request = requests.get(url)
-        if request.status_code == 200:
-            return True
-        return False
+        return self.probe(url).exists is True
+
+    def probe(self, url, cached=False, provider=None):
+        """
+        check file on portal with HEAD (or first byte GET) request, file is not downloaded
+        :param url: url to verify
+        :param cached: use AvailabilityCache, existing file is probed only once, missing file again after negative-ttl,
+            unknown availability (retry status) is not cached
+        :param provider: provider, probe uses its shared session and 'http'/'retry' settings
+        :return: ProbeResult, passed to download stage with DownloadUrl
+        """
+        if cached:
+            probe_dict = AvailabilityCache().get(url)
+            if probe_dict:
+                return ProbeResult(**probe_dict)
+        probe = Prober(provider=provider).probe(url)
+        if cached and probe.exists is not None:
+            # 304 is valid only for current local copy, cache keeps availability only
+            cached_probe = probe._replace(status_code=200) if probe.exists else probe
+            AvailabilityCache().store(url, cached_probe._asdict(), probe.exists)
+        return probe
 
     def validate_date(self, dt, date_format='%Y-%m-%d %H:%M:%S.%f'):
         """
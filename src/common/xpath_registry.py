@@ -0,0 +1,80 @@
+"""
+    xpath_registry.py
+    module contains XPathRegistry class, compiled lxml XPath evaluators shared by all downloaders
+    xpaths - registry instance used by Config and provider downloaders
+    lxml is imported on first compiled xpath, providers without xpaths (FM) never load it
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import threading
+
+from common.download_exceptions import DownloadException
+
+
+class XPathRegistry:
+    """
+    XPathRegistry compiles each xpath expression once to lxml.etree.XPath and reuses the compiled evaluator
+        get() : compiled evaluator for expression, expression is compiled on first use
+        compile_access_config() : compiles and validates all xpaths from access-config
+        compile_provider() : compiles and validates xpaths of one provider, called when provider run starts
+    """
+
+    def __init__(self):
+        self._xpaths = dict()
+        self._lock = threading.Lock()
+
+    def get(self, expression):
+        """
+        :param expression: xpath expression
+        :return: compiled lxml.etree.XPath, call it with element to evaluate
+        """
+        xpath = self._xpaths.get(expression)
+        if xpath is None:
+            from lxml import etree
+            with self._lock:
+                xpath = self._xpaths.setdefault(expression, etree.XPath(expression))
+        return xpath
+
+    def compile_access_config(self, access_config):
+        """
+        compile 'xpath' lists and BONY 'result-dict' xpaths of all access urls of all providers
+        :param access_config: access-config dictionary
+        :return: None
+        """
+        for provider, provider_config in access_config.items():
+            self.compile_provider(provider, provider_config)
+
+    def compile_provider(self, provider, provider_config):
+        """
+        compile 'xpath' lists, BONY 'result-dict' and 'pagination' xpaths of provider access urls, invalid xpath fails
+            before any request is sent
+        :param provider: provider
+        :param provider_config: access-config of provider
+        :return: None
+        """
+        expressions = [expression for a_url in provider_config.get('access-url', [])
+                       for expression in self._access_url_xpaths(a_url)]
+        if not expressions:
+            return
+        from lxml import etree
+        for expression in expressions:
+            try:
+                self.get(expression)
+            except etree.XPathSyntaxError as e:
+                raise DownloadException('1000_VALIDATION_FAILED', e,
+                                        f'Invalid xpath {expression} in access-config for {provider}') from None
+
+    def _access_url_xpaths(self, a_url):
+        expressions = list(a_url.get('xpath', []))
+        for ele_name, ele_value in a_url.get('result-dict', {}).items():
+            if isinstance(ele_value, dict):
+                expressions += ele_value.values()
+            elif isinstance(ele_value, list):
+                expressions += ele_value
+        if 'page-count' in a_url.get('pagination', {}):
+            expressions.append(a_url['pagination']['page-count'])
+        return expressions
+
+
+xpaths = XPathRegistry()
@@ -16,8 +16,68 @@ configs.py
         url - url from provider portal
         method - GET or POST depends on how actually called in portal
         input-param - these parameters used as part of query string for listed url
-        xpath - used to parse the data which is pulled from listed url
+        xpath - used to parse the data which is pulled from listed url, xpaths of provider are compiled and validated
+            when provider run starts
         result-url-dict - used to store the data for next url use, this url is listed after current url
+        pagination - optional, Bony report listings, pages after the first are requested one by one with csrfKey
+            of the previous page and their report rows are parsed with rows of the first page
+            page-count - xpath of total page count in the first page, listing has one page when it is not found
+            page-param - request parameter with page number
+            records-param, records-per-page - request parameter and number of records per page (default from
+                input-param), larger pages need fewer requests
+        session-cache - optional, authenticated session cookies are encrypted and reused by next runs
+            ttl - seconds to keep session, refreshed after each successful reuse
+            check-url - url of authenticated page to verify cached session is alive (default first GET access url),
+                session is not cached without it, public site url answers 200 for expired session too
+            Cached session is deleted when access fails on it
+        session-pool - optional, Bony only, deal inputs are split between sessions logged in separately, each session
+            runs own csrfKey chain of requests in parallel
+            size - number of sessions including the session of the run (default 1)
+        http - optional connection settings of provider sessions
+            pool-connections - number of hosts kept in connection pool (default 10)
+            pool-maxsize - connections kept per host, at least download plus access max-workers (default 10)
+            connect-timeout, read-timeout - seconds, used when request has no explicit timeout (default 10, 60)
+            min-byte-rate - download is cancelled when average bytes per second stays below it (default 0, disabled)
+            byte-rate-grace - seconds before min-byte-rate is checked (default 30)
+            keep-alive - reuse connections between requests (default true)
+            preconnect - open connections to login and access url hosts when profile starts (default false)
+        retry - optional retry settings of provider requests
+            attempts - number of attempts of a request (default 3)
+            backoff, max-backoff - first and maximal delay in seconds between attempts, delay doubles (default 1, 30)
+            jitter - random part of delay, 0.5 is +/- 50% (default 0.5)
+            statuses - response statuses retried (default 429, 500, 502, 503, 504)
+            idempotent-post - POST requests are safe to repeat, default false (Bony POSTs carry one time csrfKey)
+            failure-threshold - consecutive failures which stop requests to portal host (default 5)
+            reset-timeout - seconds before stopped portal host is tried again (default 60)
+            deferred-delay - seconds before failed files are downloaded again at the end of download (default 5)
+        rate-limit - optional limit of requests to all hosts of provider, shared by access, probe and download
+            requests-per-second - token bucket refill rate (default 0, no rate limit)
+            burst - requests sent at once after idle time (default 1)
+            max-in-flight - concurrent requests to the host (default 0, no limit)
+            Retry-After header of 429/503 response pauses all requests to the host
+        concurrency - optional adaptive (AIMD) limit of concurrent downloads and access requests, replaces fixed
+            download max-workers
+            min, max - bounds of the limit (default 1, 8), first run starts from download max-workers
+            window - number of last responses used for p95 latency (default 20)
+            latency-tolerance - limit is halved when p95 latency exceeds baseline p95 by this factor (default 2.0)
+            baseline-decay - fraction of the difference by which baseline p95 follows higher p95 (default 0.05),
+                lower p95 becomes the baseline at once
+            cooldown - minimal seconds between two reductions (default 1)
+            Limit is reduced on 429, 5xx, timeout and connection errors, chosen limit is kept in cache for next run
+        probe - optional FM file probe settings
+            max-workers - number of months/urls probed concurrently (default 1)
+        access - optional access settings
+            max-workers - number of deal pages of one access url requested concurrently (default 1), pages are
+                used in input order. Bony pages are chained by csrfKey and requested one by one
+        html-parser - optional page source parser, 'lxml' (default, fast) or 'html5lib' (slow, for malformed pages)
+        download - optional provider download settings
+            chunk-size - number of bytes streamed to output file at a time
+            max-workers - number of files downloaded concurrently (default 1)
+            volatile-params - download request params which change every run (Ex. csrfKey), these params are not
+                used to identify the file in download manifest
+            immutable - files never change once published (default false), files recorded in download manifest are
+                skipped without request. Otherwise they are revalidated with recorded ETag/Last-Modified and files
+                without validators are downloaded again
 
 === user-input-config ===
     Configuration file 'user-input-config.json' contains provider specific input and filter data, 'input' used as
@@ -38,6 +98,20 @@ configs.py
     Configuration file 'profile-config.json' contains profile names and details
     Config parameters -
         user-input-config - user input config file
+        max-workers - number of profile providers processed in parallel (default 1)
+        deadline - optional seconds allowed for all providers of the profile, commandline 'deadline' overrides it
+
+=== cache-config ===
+    Configuration file 'cache-config.json' contains settings of caches persisted between runs
+    Config parameters -
+        cache-dir - directory of cache database, FILE_DOWNLOADER_CACHE_DIR environment variable overrides it
+        availability - probe results of FM files, files which exist are never probed again
+            negative-ttl - seconds to keep 'file not available' result (404/410), probes answered with retry status
+                are not cached
+        deals - Bony deal number and name of each searched CUSIP, cached deals skip the search request
+            ttl - seconds to keep the deal (default no expiry), deal is deleted when its deal reports request fails
+    Session cookies are encrypted with key from FILE_DOWNLOADER_SESSION_KEY environment variable or from
+        '<cache-dir>/session.key', session cache requires 'cryptography' package
 
 === logger-config ===
     Configuration file 'logger-config.json' contains logger configurations, the default logger is set up to write
@@ -59,17 +133,23 @@ __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
 import json
 import os
+import threading
 from logging.config import dictConfig
 
 from common.download_exceptions import *
+from common.xpath_registry import xpaths
 
 
 class Singleton(type):
     _instances = {}
+    # singletons are created by concurrent provider threads, reentrant as singletons create other singletons
+    _lock = threading.RLock()
 
     def __call__(cls):
         if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__()
+            with Singleton._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(Singleton, cls).__call__()
         return cls._instances[cls]
 
 
@@ -81,6 +161,7 @@ class Config(metaclass=Singleton):
         Configurations for user inputs and filters, pulling from 'user-input-config.json'
         Configurations for file transfer, pulling from 'file-transfer-config.json'
         Configurations for profile, pulling from 'profile-config.json.json'
+        Configurations for caches, pulling from 'cache-config.json'
         Configurations for logging, pulling from 'logger-config.json'
     """
 
@@ -90,6 +171,7 @@ class Config(metaclass=Singleton):
         self._profile_config = self.get_config('profile-config.json')
         self._user_input_config = self.get_config('user-input-config.json')
         self._file_transfer_config = self.get_config('file-transfer-config.json')
+        self._cache_config = self.get_config('cache-config.json')
         dictConfig(self.get_config('logger-config.json'))
 
     @property
@@ -100,6 +182,10 @@ class Config(metaclass=Singleton):
     def access_config(self):
         return self._access_config
 
+    @property
+    def xpaths(self):
+        return xpaths
+
     @property
     def profile_config(self):
         return self._profile_config
@@ -112,6 +198,10 @@ class Config(metaclass=Singleton):
     def file_transfer_config(self):
         return self._file_transfer_config
 
+    @property
+    def cache_config(self):
+        return self._cache_config
+
     def get_config(self, _config_file):
         """
         pull all configs initialized in init, raise exception if file not exists
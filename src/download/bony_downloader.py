@@ -5,49 +5,51 @@
 
 __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
+import copy
 import datetime
 import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import lxml.html
-import requests
-
+from common.cache import DealCache
 from common.download_exceptions import DownloadException
+from common.utils import DownloadUrl
+from common.xpath_registry import xpaths
 from download.file_downloader import FileDownloader
 
 
 class BonyDownloader(FileDownloader):
     """
     BonyDownloader class has functions for parsing page source code
-        parse()  : implementation for 'BONY' provider
+        access_pages() : csrfKey chains of deal requests, split between sessions of session pool
+        parse_page() : implementation for 'BONY' provider
     """
+    CSRF_KEY_XPATH = xpaths.get('//form[@name="NavForm"]/input[@name="csrfKey"]/@value')
+    # report table row xpaths
+    REPORT_ID_XPATH = xpaths.get('td/input[@name="cb_rpt_id"]/@value')
+    REPORT_NAME_XPATH = xpaths.get('td[2]/a/text()')
+    PAYMENT_DATE_XPATH = xpaths.get('td[6]/text()')
+    REPORT_FILE_XPATH = xpaths.get('td/span[@class="RecordNormalText"]/input')
+    # user-input-config input searched by CUSIP search request
+    SEARCH_INPUT = 'hd_search_for'
+
+    def __init__(self):
+        super().__init__()
+        # session pool logins and session of each csrfKey chain, used to download reports on the session listing them
+        self._pool_sessions = list()
+        self._csrf_sessions = dict()
 
-    def authenticate(self, provider):
+    def _auth_response_dict(self, provider, response):
         """
-        Step 1:: Authenticate and login to provider's portal
+        BONY request need certificate key for each request
         :param provider: provider
-        :return: requests session
-        """
-        logging.debug('BonyDownloader:authenticate')
-        auth_config = self.configs.auth_config[provider]
-        access_config = self.configs.access_config[provider]
-        session = requests.Session()
-        logging.debug(f':::1 Connect to {access_config["login-url"]} and get cookies')
-        session.get(access_config['login-url'])
-        logging.debug(f':::2 Call {access_config["auth-url"]} page')
-        # requests will use the available cookies from session
-        try:
-            res1 = session.post(access_config["auth-url"], data=auth_config)
-            if self._login_failed(provider, res1):
-                raise DownloadException('2000_AUTHENTICATION_FAILED',
-                                        custom_message=f"Authentication failed for {provider}")
-            logging.debug(f'Login status :: {res1.status_code}')
-            # BONY request need certificate key for each request
-            f_html = self.utils.format_html(res1.text)
-            tree = lxml.html.fromstring(f_html)
-            csrf_key = tree.xpath('//form[@name="NavForm"]/input[@name="csrfKey"]/@value')[0]
-        except Exception as e:
-            raise DownloadException('2000_AUTHENTICATION_FAILED', e) from None
-        return session, {'for_next_params': True, 'csrfKey': csrf_key}
+        :param response: authenticated page response
+        :return: csrfKey for next request
+        """
+        tree = self.utils.html_tree(response.content, self._html_parser(provider))
+        return {'for_next_params': True, 'csrfKey': self.CSRF_KEY_XPATH(tree)[0]}
 
     def _login_failed(self, provider, response):
         if 'Invalid Login' in response.text:
@@ -55,47 +57,183 @@ class BonyDownloader(FileDownloader):
         else:
             return False
 
-    def access(self, session, **opts):
+    def access_pages(self, session, **opts):
         """
-        Step 2:: Pull access URL/s from configs file and use it to pull page source which has URLs for file download
-            after method execution a_url['deal_info_dict_list'] appended to opts dictionary
-        TODO Use namedtuple DealInfo to make current dictionary generic to all providers
+        Step 2:: Pull access URL/s from configs file and use it to pull page source which has URLs for file download,
+            yields each deal page as soon as report table rows are selected
+            Each request needs csrfKey of the previous response, so requests of one session are one chain. With
+            provider 'session-pool' settings deal inputs are split between 'size' sessions, every session logs in
+            separately and runs its own chain (search -> DealReports) on own thread. Pages are yielded as they are
+            received and a_url['deal_info_dict_list'] keeps input order
         :param session: session with site cookies
         :param opts: user/commandline inputs
+        :return: generator of a_url and deal_info dictionary with 'f_html'
+        """
+        user_inputs = self._user_input_config(**opts)['input']
+        input_count = sum(len(attr_values) for attr_values in user_inputs.values())
+        pool_size = min(self.configs.access_config[opts['provider']].get('session-pool', {}).get('size', 1),
+                        input_count)
+        pool = [(session, opts.get('response_dict'))]
+        if pool_size > 1:
+            pool += self._login_pool(opts['provider'], pool_size - 1)
+        if len(pool) == 1:
+            yield from self._access_chain(session, **opts)
+            return
+        shard_opts = list()
+        for (shard_session, response_dict), shard_inputs in zip(pool, self._shard_inputs(user_inputs, len(pool))):
+            shard_opts.append({**opts, 'access_urls': copy.deepcopy(opts['access_urls']),
+                               'response_dict': response_dict,
+                               'user_input_config': {**self._user_input_config(**opts), 'input': shard_inputs}})
+        yield from self._merge_chains(pool, shard_opts, **opts)
+        # deal pages of each access url in input order
+        for position, a_url in enumerate(opts['access_urls']):
+            a_url['deal_info_dict_list'] = [deal_info for o in shard_opts
+                                            for deal_info in o['access_urls'][position].get('deal_info_dict_list', [])]
+
+    def _login_pool(self, provider, count):
+        """
+        :param provider: provider
+        :param count: number of additional sessions
+        :return: list of (session, response_dict), failed logins are left out and their inputs go to other sessions
+        """
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(self._login, provider) for _ in range(count)]
+        pool = list()
+        for future in futures:
+            if future.exception():
+                logging.warning(f'{provider} session pool login failed :: {future.exception()}')
+            else:
+                pool.append(future.result())
+                self._pool_sessions.append(future.result()[0])
+        logging.info(f'{provider} session pool of {len(pool) + 1} sessions')
+        return pool
+
+    @staticmethod
+    def _shard_inputs(user_inputs, count):
+        """
+        :param user_inputs: user-input-config inputs, attribute name and list of values
+        :param count: number of shards
+        :return: list of user inputs, consecutive values in each shard so shards joined in order give all inputs
+        """
+        pairs = [(attr_name, attr_value) for attr_name, attr_values in user_inputs.items()
+                 for attr_value in attr_values]
+        size = -(-len(pairs) // count)
+        shards = list()
+        for start in range(0, len(pairs), size):
+            shard = dict()
+            for attr_name, attr_value in pairs[start:start + size]:
+                shard.setdefault(attr_name, list()).append(attr_value)
+            shards.append(shard)
+        return shards
+
+    def _merge_chains(self, pool, shard_opts, **opts):
+        """
+        runs access chain of each shard on own thread and yields pages as they are received, at most two pages per
+            session wait to be used. Session of each deal page is kept by csrfKey for the file downloads
+        :return: generator of a_url (from opts) and deal_info
+        """
+        pages = queue.Queue(maxsize=2 * len(pool))
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def run(shard_session, o):
+            positions = {id(a_url): position for position, a_url in enumerate(o['access_urls'])}
+            try:
+                for a_url, deal_info in self._access_chain(shard_session, **o):
+                    self._csrf_sessions[deal_info['for_next_params']['csrfKey']] = shard_session
+                    if not put((positions[id(a_url)], deal_info, None)):
+                        return
+                put((None, None, None))
+            except Exception as e:
+                put((None, None, e))
+
+        with ThreadPoolExecutor(max_workers=len(pool)) as executor:
+            try:
+                for (shard_session, _), o in zip(pool, shard_opts):
+                    executor.submit(run, shard_session, o)
+                running = len(shard_opts)
+                while running:
+                    position, deal_info, error = pages.get()
+                    if error:
+                        raise error
+                    if deal_info is None:
+                        running -= 1
+                    else:
+                        yield opts['access_urls'][position], deal_info
+            finally:
+                stopped.set()
+
+    def _session_for(self, download_url, session):
+        """
+        :param download_url: DownloadUrl
+        :param session: session of provider run
+        :return: session which listed the report, download request carries csrfKey of its chain
+        """
+        return self._csrf_sessions.get((download_url.params or {}).get('csrfKey'), session)
+
+    def close_session(self, session):
+        """
+        close session and sessions of the pool
+        :param session: requests session
         :return: None
         """
+        for pool_session in self._pool_sessions:
+            pool_session.close()
+        self._pool_sessions = list()
+        self._csrf_sessions = dict()
+        super().close_session(session)
+
+    def _access_chain(self, session, **opts):
+        """
+        requests of one session, every request uses csrfKey of the previous response
+        TODO Use namedtuple DealInfo to make current dictionary generic to all providers
+        :param session: session with site cookies
+        :param opts: user/commandline inputs
+        :return: generator of a_url and deal_info dictionary with 'f_html'
+        """
         logging.debug('FileDownloader:access')
-        provider = opts['provider']
         previous_url_results = list()
         for a_url in opts['access_urls']:
             logging.debug(f':::3 Send request to {a_url} page')
             # Pull input parameters to append as a query string
-            user_config = opts['user_input_config'] if 'user_input_config' in opts else None
-            user_inputs = user_config['input'] if user_config else self.configs.user_input_config[provider][
-                'input']
+            user_inputs = self._user_input_config(**opts)['input']
             deal_info_list = self._prepare_params(a_url, user_inputs)
             # Update URL with values pulled from previous page response
             deal_info_list = self._use_previous_url_result(deal_info_list, previous_url_results)
+            a_url['deal_info_dict_list'] = deal_info_list
             # After use clean the previous_url_results
             previous_url_results = []
             for deal_info in deal_info_list:
+                cached = self._cached_search(a_url, deal_info)
+                if cached:
+                    # deal number of searched CUSIP is known, search request is skipped
+                    previous_url_results.append(cached)
+                    deal_info['for_next_params'] = cached
+                    continue
                 params = deal_info['params']
                 from_opts = opts['response_dict'] if 'response_dict' in opts else {}
                 params = {**params, **from_opts}
+                if 'records-per-page' in a_url.get('pagination', {}):
+                    params[a_url['pagination']['records-param']] = str(a_url['pagination']['records-per-page'])
                 opts['response_dict'] = {}
                 try:
-                    if a_url['method'] == 'POST':
-                        res = session.post(deal_info['link'], data=params)
-                    elif a_url['method'] == 'GET':
-                        res = session.get(deal_info['link'], params=params)
-                except Exception as e:
-                    raise DownloadException('3000_ACCESS_FAILED', e)
-                logging.debug(f'status code :: {res.status_code} history :: {res.history} response URL :: {res.url}')
-                f_html = self.utils.format_html(res.text)
-                tree = lxml.html.fromstring(f_html)
+                    tree = self._fetch_page(session, a_url, deal_info['link'], params, **opts)
+                    # pages after the first, csrfKey for next request is taken from the last page
+                    trees = [tree] + self._next_pages(session, a_url, deal_info['link'], params, tree, **opts)
+                except DownloadException:
+                    self._invalidate_deal(deal_info)
+                    raise
                 for ele_name, ele_value in a_url['result-dict'].items():
                     if 'for_next_params' in ele_name:
-                        _result = self._dict_for_next_url(ele_value, tree)
+                        _result = self._dict_for_next_url(ele_value, trees[-1])
                         _result['for_next_params'] = True
                         previous_url_results.append(_result)
                         deal_info['for_next_params'] = _result
@@ -106,12 +244,104 @@ class BonyDownloader(FileDownloader):
                         previous_url_results.append(_result)
                     elif 'deal_info' in ele_name:
                         deal_info['deal_info'] = self._dict_for_next_url(ele_value, tree)
+                        self._store_deal(deal_info)
                     elif 'for_parsing' in ele_name:
                         f_html_trees = list()
                         for xp in ele_value:
-                            f_html_trees.append(tree.xpath(xp))
+                            f_html_trees.append([row for page in trees for row in self.configs.xpaths.get(xp)(page)])
                         deal_info['f_html'] = f_html_trees
-            a_url['deal_info_dict_list'] = deal_info_list
+                if 'f_html' in deal_info:
+                    yield a_url, deal_info
+
+    def _fetch_page(self, session, a_url, link, params, **opts):
+        """
+        :param session: session with site cookies
+        :param a_url: access url dictionary from access-config
+        :param link: url
+        :param params: request parameters
+        :param opts: user/commandline inputs
+        :return: parsed page
+        """
+        provider = opts['provider']
+        self._check_deadline(opts, f'{a_url["method"]} - {link}')
+        try:
+            if a_url['method'] == 'POST':
+                res = self._request(session, 'POST', link, provider, opts.get('deadline'), data=params)
+            else:
+                res = self._request(session, 'GET', link, provider, opts.get('deadline'), params=params)
+        except Exception as e:
+            raise DownloadException('3000_ACCESS_FAILED', e)
+        logging.debug(f'status code :: {res.status_code} history :: {res.history} response URL :: {res.url}')
+        return self.utils.html_tree(res.content, self._html_parser(provider))
+
+    def _next_pages(self, session, a_url, link, params, first_page, **opts):
+        """
+        pages 2 to 'page-count' of access url with 'pagination' settings, pages are part of the csrfKey chain and are
+            requested one by one, each with csrfKey of the previous page
+        :param session: session with site cookies
+        :param a_url: access url dictionary from access-config
+        :param link: url
+        :param params: request parameters of the first page
+        :param first_page: parsed first page
+        :param opts: user/commandline inputs
+        :return: list of parsed pages in page order, empty when listing has one page
+        """
+        pagination = a_url.get('pagination')
+        if not pagination:
+            return []
+        page_count = ''.join(self.configs.xpaths.get(pagination['page-count'])(first_page)).strip()
+        if not page_count.isdigit() or int(page_count) <= 1:
+            return []
+        logging.debug(f'{link} has {page_count} pages')
+        pages = list()
+        page = first_page
+        for page_number in range(2, int(page_count) + 1):
+            csrf_key = self.CSRF_KEY_XPATH(page)
+            page_params = {**params, 'csrfKey': csrf_key[0]} if csrf_key else params
+            page = self._fetch_page(session, a_url, link, {**page_params, pagination['page-param']: str(page_number)},
+                                    **opts)
+            pages.append(page)
+        return pages
+
+    def _cached_search(self, a_url, deal_info):
+        """
+        :param a_url: access url dictionary from access-config
+        :param deal_info: request details with 'params'
+        :return: search result from DealCache when a_url is CUSIP search and the deal is cached, otherwise None
+        """
+        if 'hd_deal_number' not in a_url['result-dict'].get('for_next_params', {}):
+            return None
+        cusip = deal_info['params'].get(self.SEARCH_INPUT)
+        deal = DealCache().get(cusip) if cusip else None
+        if deal is None:
+            return None
+        logging.debug(f'{cusip} is cached deal {deal["deal_name"]}')
+        return {'hd_deal_number': deal['deal_number'], 'for_next_params': True}
+
+    def _store_deal(self, deal_info):
+        """
+        caches deal number and name of searched CUSIP, deal reports page without deal deletes cached deal
+        :param deal_info: deal reports request details with 'params' and 'deal_info' from the page
+        :return: None
+        """
+        cusip = deal_info['params'].get(self.SEARCH_INPUT)
+        deal_number = deal_info['params'].get('hd_deal_number')
+        if not cusip or not deal_number:
+            return
+        if deal_info['deal_info'].get('deal_name'):
+            DealCache().store(cusip, deal_number, deal_info['deal_info']['deal_name'])
+        else:
+            logging.warning(f'Deal reports of {cusip} not found for deal number {deal_number}')
+            DealCache().delete(cusip)
+
+    def _invalidate_deal(self, deal_info):
+        """
+        :param deal_info: failed request details with 'params'
+        :return: None
+        """
+        cusip = deal_info['params'].get(self.SEARCH_INPUT)
+        if cusip and 'hd_deal_number' in deal_info['params']:
+            DealCache().delete(cusip)
 
     def _prepare_params(self, a_url, user_inputs):
         # pull mandatory input parameters from access-config
@@ -130,7 +360,8 @@ class BonyDownloader(FileDownloader):
             for link, previous_url_result in zip(links, previous_url_results):
                 if 'hd_deal_number' in previous_url_result:
                     deal_num = previous_url_result['hd_deal_number']
-                    deal_num = deal_num[:deal_num.index('~')] if deal_num else deal_num
+                    # search result value is '<deal number>~<class>', cached deal number has no class
+                    deal_num = deal_num.split('~', 1)[0] if deal_num else deal_num
                     previous_url_result['hd_deal_number'] = deal_num
                 if 'for_next_params' in previous_url_result:
                     link['params'] = {**link['params'], **previous_url_result}
@@ -145,58 +376,55 @@ class BonyDownloader(FileDownloader):
         result_dict = dict()
         for k, xp in input_dict.items():
             try:
-                xp_result = tree.xpath(xp)
+                xp_result = self.configs.xpaths.get(xp)(tree)
                 result_dict[k] = ''.join(xp_result).strip()
             except Exception as e:
                 raise DownloadException('3000_ACCESS_FAILED', e)
         return result_dict
 
-    def parse(self, **opts):
+    def parse_page(self, a_url, deal_info_dict, trs_list, **opts):
         """
-        method parses the 'BONY' specific page source using xpath from access-configs, after method execution
-            a_url['download_urls'] appended to opts dictionary
-        :param opts: user/commandline inputs + a_url['deal_info_dict_list']
-        :return:
+        method parses the 'BONY' specific deal reports using xpath from access-configs
+        :param a_url: access url dictionary from access-config
+        :param deal_info_dict: deal page details
+        :param trs_list: report table rows of deal page, one list for each 'for_parsing' xpath
+        :param opts: user/commandline inputs
+        :return: list of DownloadUrl
         """
         logging.debug('BonyDownloader:parse')
         out_dir = opts['output']
         provider = opts['provider']
-        for a_url in opts['access_urls']:
-            download_urls = list()
-            for deal_info_dict in a_url['deal_info_dict_list']:
-                if 'f_html' in deal_info_dict:
-                    f_url = a_url['for_download_urls']['download_url']
-                    input_dict = a_url['for_download_urls']['request_body'].copy()
-                    for k, v in deal_info_dict['for_next_params'].items():
-                        if 'for_next_params' not in k:
-                            input_dict[k] = v
-                    deal_name = deal_info_dict['deal_info']['deal_name']
-                    for trs in deal_info_dict['f_html']:
-                        for tr in trs:
-                            # print(f'table.text :: {etree.tostring(tr)}')
-                            report_id = tr.xpath('td/input[@name="cb_rpt_id"]/@value')
-                            report_name = ''.join(tr.xpath('td[2]/a/text()')).strip()
-                            if len(report_id) > 0:
-                                report_id = report_id[0][:report_id[0].index('~')]
-                            payment_date = tr.xpath('td[6]/text()')
-                            if len(payment_date) > 0:
-                                payment_date = payment_date[0].strip()
-                                dt = datetime.datetime.strptime(payment_date, "%d-%b-%Y")
-                            for span in tr.xpath('td/span[@class="RecordNormalText"]/input'):
-                                report_ext_key = span.xpath('@name')[0]
-                                report_ext_value = span.xpath('@value')[0]
-                                file_extension = report_ext_value[report_ext_value.index('~') + 1:]
-                                input_dict_copy = dict(input_dict)
-                                input_dict_copy['hd_avl_rpt_id'] = report_id
-                                input_dict_copy[report_ext_key] = report_ext_value
-                                input_dict_copy['lb_reportdate'] = dt.strftime("%B") + '++' + str(dt.year)
-                                input_dict_copy['hd_extension'] = file_extension
-                                o_file = out_dir + '/' + str(dt.year) + '-' + str(dt.month) + '/' + provider + '/'
-                                o_file += (deal_name + ' pay ' + payment_date + ' ' + report_name).replace(' ', '_')
-                                o_file += '.' + file_extension
-                                search_data = report_id + ' || ' + report_name + ' || ' + dt.strftime("%b") + ' '
-                                search_data += str(dt.year) + ' || ' + deal_name
-                                download_urls.append(
-                                    DownloadUrl(f_url, o_file, search_data, deal_name, input_dict_copy, 'POST'))
-                    # del a_url['f_html']
-                    a_url['download_urls'] = download_urls
+        download_urls = list()
+        f_url = a_url['for_download_urls']['download_url']
+        input_dict = a_url['for_download_urls']['request_body'].copy()
+        for k, v in deal_info_dict['for_next_params'].items():
+            if 'for_next_params' not in k:
+                input_dict[k] = v
+        deal_name = deal_info_dict['deal_info']['deal_name']
+        for trs in trs_list:
+            for tr in trs:
+                # print(f'table.text :: {etree.tostring(tr)}')
+                report_id = self.REPORT_ID_XPATH(tr)
+                report_name = ''.join(self.REPORT_NAME_XPATH(tr)).strip()
+                if len(report_id) > 0:
+                    report_id = report_id[0][:report_id[0].index('~')]
+                payment_date = self.PAYMENT_DATE_XPATH(tr)
+                if len(payment_date) > 0:
+                    payment_date = payment_date[0].strip()
+                    dt = datetime.datetime.strptime(payment_date, "%d-%b-%Y")
+                for span in self.REPORT_FILE_XPATH(tr):
+                    report_ext_key = span.get('name')
+                    report_ext_value = span.get('value')
+                    file_extension = report_ext_value[report_ext_value.index('~') + 1:]
+                    input_dict_copy = dict(input_dict)
+                    input_dict_copy['hd_avl_rpt_id'] = report_id
+                    input_dict_copy[report_ext_key] = report_ext_value
+                    input_dict_copy['lb_reportdate'] = dt.strftime("%B") + '++' + str(dt.year)
+                    input_dict_copy['hd_extension'] = file_extension
+                    o_file = out_dir + '/' + str(dt.year) + '-' + str(dt.month) + '/' + provider + '/'
+                    o_file += (deal_name + ' pay ' + payment_date + ' ' + report_name).replace(' ', '_')
+                    o_file += '.' + file_extension
+                    search_data = report_id + ' || ' + report_name + ' || ' + dt.strftime("%b") + ' '
+                    search_data += str(dt.year) + ' || ' + deal_name
+                    download_urls.append(DownloadUrl(f_url, o_file, search_data, deal_name, input_dict_copy, 'POST'))
+        return download_urls
@@ -0,0 +1,91 @@
+"""
+    downloader_registry.py
+    module contains DownloaderRegistry class, maps provider keys to downloader classes which are imported on first use
+    downloaders - registry instance used by processor
+"""
+
+__author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+
+import importlib
+import importlib.metadata
+import logging
+import threading
+
+from common.download_exceptions import DownloadException
+
+
+class DownloaderRegistry:
+    """
+    DownloaderRegistry keeps 'module:Class' of downloader for each provider, provider module (and lxml/bs4 it needs) is
+        imported only when provider is processed. Downloaders of other packages are registered with entry points in
+        'file_downloader.downloaders' group, entry point name is provider key and value is 'module:Class'
+        register() : adds or replaces downloader of provider
+        get() : downloader class of provider, raises DownloadException 1001 for unknown provider
+        create() : new downloader object of provider
+    """
+    ENTRY_POINT_GROUP = 'file_downloader.downloaders'
+    BUILT_IN = {
+        'fm': 'download.fm_downloader:FMDownloader',
+        'ct': 'download.ct_downloader:CTDownloader',
+        'wil': 'download.wil_downloader:WilDownloader',
+        'ubn': 'download.ubn_downloader:UbnDownloader',
+        'wf-wffm': 'download.wf_downloader:WFDownloader',
+        'wf-ry': 'download.wf_downloader:WFDownloader',
+        'wf-wfeu': 'download.wf_downloader:WFDownloader',
+        'bony': 'download.bony_downloader:BonyDownloader',
+    }
+
+    def __init__(self):
+        self._targets = dict(self.BUILT_IN)
+        self._classes = dict()
+        self._entry_points_loaded = False
+        self._lock = threading.Lock()
+
+    def register(self, provider, target):
+        """
+        :param provider: provider key
+        :param target: 'module:Class' or downloader class
+        :return: None
+        """
+        with self._lock:
+            self._targets[provider] = target
+            self._classes.pop(provider, None)
+
+    def get(self, provider):
+        """
+        :param provider: provider key
+        :return: downloader class
+        """
+        with self._lock:
+            if provider not in self._classes:
+                if provider not in self._targets:
+                    self._load_entry_points()
+                if provider not in self._targets:
+                    raise DownloadException('1001_INVALID_PROVIDER', custom_message=f'No support for provider '
+                                                                                    f':: {provider}')
+                self._classes[provider] = self._load(self._targets[provider])
+            return self._classes[provider]
+
+    def create(self, provider):
+        """
+        :param provider: provider key
+        :return: provider specific downloader object
+        """
+        return self.get(provider)()
+
+    def _load(self, target):
+        if not isinstance(target, str):
+            return target
+        module_name, class_name = target.split(':')
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def _load_entry_points(self):
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        for entry_point in importlib.metadata.entry_points(group=self.ENTRY_POINT_GROUP):
+            logging.debug(f'Downloader plugin {entry_point.name} :: {entry_point.value}')
+            self._targets.setdefault(entry_point.name, entry_point.value)
+
+
+downloaders = DownloaderRegistry()
@@ -6,15 +6,28 @@
 __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
 import abc
+import collections
 import datetime
+import hashlib
+import itertools
+import json
 import logging
+import os
+import time
+import urllib.parse
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
-import lxml.html
 import requests
-from dateutil.relativedelta import relativedelta
 
+from common.cache import SessionCache, ValidatorCache
+from common.concurrency import ConcurrencyController
 from common.download_exceptions import DownloadException
-from common.utils import Utils
+from common.filter_index import FilterIndex
+from common.http_client import HttpClient
+from common.manifest import DownloadManifest
+from common.retry import RetryPolicy
+from common.utils import DownloadResult, Utils
 from configs.config import Config
 
 
@@ -23,15 +36,29 @@ class FileDownloader(metaclass=abc.ABCMeta):
     class provides the functions for whole file downloading functionality, file downloader has -
         authentication() : checks authentication details in auth_config and authenticates using provided user details,
                            returns session object after successful login
-        access() : navigates through the portal, pulls page source code and generates formatted page source,
-                   formatted html appended to opts dictionary (a_url['f_html'] = f_html_list)
-        parse()  : abstract function, each provider has to implementation their own parsing functionality,
-                   parser generates list of download url dictionaries, appends a_url['download_urls'] to opts
+        access() : navigates through the portal, pulls page source code and parses it to lxml tree,
+                   parsed page appended to opts dictionary (deal_info['f_html'] = tree)
+        parse()  : parses every deal page once, each provider has to implementation their own parsing functionality
+                   in parse_page(), parser generates list of download url dictionaries, appends a_url['download_urls']
+                   to opts
         filter() : filters the URLs dictionary using user inputs (provided in user-input-configs)
                    and updates download url dictionaries
         download_files() : Downloads files to output directory using details provided in download url dictionary
+        stream() : access, parse, filter and download as one pipeline, downloads start with the first matching url
         file_transfer()  : Transfers the files to desired path (configured in file-transfer-configs)
     """
+    # Defaults for provider 'download' settings in access-config
+    DOWNLOAD_DEFAULTS = {'chunk-size': 1024 * 1024, 'max-workers': 1, 'volatile-params': [], 'immutable': False}
+    # Files are written under this suffix and renamed once the download is complete
+    PART_SUFFIX = '.part'
+    # ETag/Last-Modified of the partial file, kept next to '.part' file to resume the download
+    VALIDATORS_SUFFIX = '.validators'
+    # DownloadResult status values
+    STATUS_DOWNLOADED = 'downloaded'
+    STATUS_SKIPPED = 'skipped'
+    STATUS_FAILED = 'failed'
+    # Sessions restored from SessionCache by this process, their cache entry is deleted when access fails
+    _restored_sessions = weakref.WeakSet()
 
     def __init__(self):
         self._configs = Config()
@@ -48,75 +75,250 @@ class FileDownloader(metaclass=abc.ABCMeta):
 
     def authenticate(self, provider):
         """
-        Step 1:: Authenticate and login to provider's portal
+        Step 1:: Authenticate and login to provider's portal, warm session from SessionCache is reused while it is
+            alive (provider 'session-cache' in access-config), otherwise login and cache the new session
         :param provider: provider
-        :return: requests session
+        :return: requests session and values required by next requests (Ex. Bony csrfKey)
         """
         logging.debug('FileDownloader:authenticate')
+        cached = self._cached_session(provider)
+        if cached:
+            return cached
+        session, response_dict = self._login(provider)
+        self._cache_session(provider, session)
+        return session, response_dict
+
+    def _login(self, provider):
+        """
+        login to provider's portal
+        :param provider: provider
+        :return: requests session and values required by next requests
+        """
         auth_config = self.configs.auth_config[provider]
         access_config = self.configs.access_config[provider]
-        session = requests.Session()
+        session = HttpClient().session(provider)
         logging.debug(f':::1 Connect to {access_config["login-url"]} and get cookies')
-        session.get(access_config['login-url'])
+        self._request(session, 'GET', access_config['login-url'], provider)
         # logging.info(f'Session cookies {s.cookies.get_dict()}')
         logging.debug(f':::2 Call {access_config["auth-url"]} page')
         # requests will use the available cookies from session
         try:
-            res1 = session.post(access_config["auth-url"], data=auth_config)
+            res1 = self._request(session, 'POST', access_config["auth-url"], provider, data=auth_config)
             if self._login_failed(provider, res1):
                 raise DownloadException('2000_AUTHENTICATION_FAILED',
                                         custom_message=f"Authentication failed for {provider}")
             logging.debug(f'Login status :: {res1.status_code}')
             # logging.info(f'Page Details:::: {res1.status_code}, {res1.cookies.get_dict()}, res1.headers, {res1.text}')
+            response_dict = self._auth_response_dict(provider, res1)
         except Exception as e:
             raise DownloadException('2000_AUTHENTICATION_FAILED', e) from None
-        return session, None
+        return session, response_dict
 
     def _login_failed(self, provider, response):
         return False
 
+    def _auth_response_dict(self, provider, response):
+        """
+        values from authenticated page required by next requests, used after login and after session liveness check
+        :param provider: provider
+        :param response: authenticated page response
+        :return: dictionary of values or None
+        """
+        return None
+
+    def session_key(self, provider):
+        """
+        providers on the same portal (login-url/auth-url hosts) with the same credentials share one session
+        :param provider: provider
+        :return: session key, changed credentials never reuse old session
+        """
+        access_config = self.configs.access_config[provider]
+        hosts = [urllib.parse.urlsplit(access_config[u]).netloc for u in ('login-url', 'auth-url')]
+        auth_config = json.dumps(self.configs.auth_config[provider], sort_keys=True)
+        return '|'.join(hosts) + ':' + hashlib.sha256(auth_config.encode()).hexdigest()[:16]
+
+    def close_session(self, session):
+        """
+        close session after all providers sharing it are processed
+        :param session: requests session
+        :return: None
+        """
+        session.close()
+
+    def _cached_session(self, provider):
+        """
+        restore cached session cookies and check session is still alive with 'check-url' request
+        :param provider: provider
+        :return: requests session and values required by next requests, None when login is required
+        """
+        session_config = self.configs.access_config[provider].get('session-cache')
+        if not session_config or not SessionCache().enabled or not self._session_check_url(provider, session_config):
+            return None
+        key = self.session_key(provider)
+        cookies = SessionCache().load(key)
+        if cookies is None:
+            return None
+        session = HttpClient().session(provider)
+        SessionCache.restore_cookies(session.cookies, cookies)
+        try:
+            res = self._request(session, 'GET', self._session_check_url(provider, session_config), provider)
+            if self._session_expired(provider, res):
+                raise DownloadException('2000_AUTHENTICATION_FAILED', custom_message='Session expired')
+            response_dict = self._auth_response_dict(provider, res)
+        except Exception as e:
+            logging.info(f'Cached session of {provider} is not alive, login again :: {e}')
+            SessionCache().delete(key)
+            session.close()
+            return None
+        logging.debug(f'Reusing cached session of {provider}')
+        self._cache_session(provider, session)
+        self._restored_sessions.add(session)
+        return session, response_dict
+
+    def discard_cached_session(self, provider, session):
+        """
+        delete SessionCache entry when access failed on session restored from it, next run logs in again
+        :param provider: provider
+        :param session: session used by failed access
+        :return: None
+        """
+        if session in self._restored_sessions:
+            logging.info(f'Access failed on cached session of {provider}, cached session is deleted')
+            SessionCache().delete(self.session_key(provider))
+            self._restored_sessions.discard(session)
+
+    def _session_check_url(self, provider, session_config):
+        """
+        :param provider: provider
+        :param session_config: provider 'session-cache' settings
+        :return: 'check-url' or first GET access url, None when provider has no authenticated page to check (public
+            site url answers 200 for expired session too) and session is not cached
+        """
+        access_config = self.configs.access_config[provider]
+        get_urls = [a_url['url'] for a_url in access_config['access-url'] if a_url['method'] == 'GET']
+        return session_config.get('check-url') or (get_urls[0] if get_urls else None)
+
+    def _session_expired(self, provider, response):
+        """
+        :param provider: provider
+        :param response: response of session check url
+        :return: True when portal rejected the session or redirected to login page
+        """
+        login_url = self.configs.access_config[provider]['login-url']
+        return response.status_code != 200 or self._login_failed(provider, response) or \
+            (bool(response.history) and response.url.rstrip('/') == login_url.rstrip('/'))
+
+    def _cache_session(self, provider, session):
+        session_config = self.configs.access_config[provider].get('session-cache')
+        if session_config and SessionCache().enabled and self._session_check_url(provider, session_config):
+            SessionCache().save(self.session_key(provider), SessionCache.cookie_list(session.cookies),
+                                session_config.get('ttl', 30 * 60))
+
     def access(self, session, **opts):
         """
         Step 2:: Pull access URL/s from configs file and use it to pull page source which has URLs for file download
             after method execution a_url['deal_info_dict_list'] appended to opts dictionary
-        TODO Use namedtuple DealInfo to make current dictionary generic to all providers
         :param session: session with site cookies
         :param opts: user/commandline inputs
         :return: None
         """
+        for _ in self.access_pages(session, **opts):
+            pass
+
+    def access_pages(self, session, **opts):
+        """
+        requests access urls and yields each deal page as soon as it is parsed to lxml tree,
+            a_url['deal_info_dict_list'] is appended to opts dictionary before the first page of access url is requested
+        TODO Use namedtuple DealInfo to make current dictionary generic to all providers
+        :param session: session with site cookies
+        :param opts: user/commandline inputs
+        :return: generator of a_url and deal_info dictionary with 'f_html'
+        """
         logging.debug('FileDownloader:access')
-        provider = opts['provider']
         previous_url_results = list()
         for a_url in opts['access_urls']:
             logging.debug(f':::3 Send request to {a_url} page')
             deal_info_list = list()
             # Pull input parameters to append as a query string
             if len(a_url['input-param']) > 0:
-                user_config = opts['user_input_config'] if 'user_input_config' in opts else None
-                user_inputs = user_config['input'] if user_config else self.configs.user_input_config[provider]['input']
+                user_inputs = self._user_input_config(**opts)['input']
                 deal_info_list = self._append_query_str_to_url(a_url, user_inputs)
             else:
                 deal_info_list.append(a_url['url'])
             # Update URL with value pulled from previous page
             deal_info_list = self._urls_with_previous_result(a_url, deal_info_list, previous_url_results)
-            for deal_info in deal_info_list:
-                link = deal_info['link']
-                params = deal_info['params'] if 'params' in deal_info else {}
-                try:
-                    if a_url['method'] == 'POST':
-                        res = session.post(link, data=params)
-                    elif a_url['method'] == 'GET':
-                        res = session.get(link, params=params)
-                except Exception as e:
-                    raise DownloadException('3000_ACCESS_FAILED', e, f'Access failed for {a_url["method"]} - {link}')
-                logging.debug(f'status code :: {res.status_code} history :: {res.history} response URL :: {res.url}')
-                if len(a_url['xpath']) > 0:
-                    f_html = self.utils.format_html(res.text)
-                    if 'for_next_url' in a_url['result-url-dict'] or 'for_next_params' in a_url['result-url-dict']:
-                        previous_url_results.append(self._values_for_next_url(a_url, f_html))
-                    else:
-                        deal_info['f_html'] = f_html
             a_url['deal_info_dict_list'] = deal_info_list
+            for deal_info, f_html in self._fetch_pages(session, a_url, deal_info_list, **opts):
+                if f_html is None:
+                    continue
+                if 'for_next_url' in a_url['result-url-dict'] or 'for_next_params' in a_url['result-url-dict']:
+                    previous_url_results.append(self._values_for_next_url(a_url, f_html))
+                else:
+                    deal_info['f_html'] = f_html
+                    yield a_url, deal_info
+
+    def _fetch_pages(self, session, a_url, deal_info_list, **opts):
+        """
+        requests of one access url are independent (values of previous access urls are already in deal_info_list),
+            pages are requested by provider 'access' -> 'max-workers' threads and each request waits for a slot of
+            provider ConcurrencyController when provider has 'concurrency' settings. At most two pages per thread wait
+            to be used, so pages held in memory do not grow with number of inputs
+        :param session: session with site cookies
+        :param a_url: access url dictionary from access-config
+        :param deal_info_list: deal page details with 'link' and 'params'
+        :param opts: user/commandline inputs
+        :return: generator of deal_info and parsed page (None when access url has no xpath), in deal_info_list order
+        """
+        provider = opts['provider']
+        max_workers = self.configs.access_config[provider].get('access', {}).get('max-workers', 1)
+        controller = self._concurrency(provider)
+
+        def fetch(deal_info):
+            if controller is None:
+                return deal_info, self._fetch_page(session, a_url, deal_info, **opts)
+            with controller.slot():
+                return deal_info, self._fetch_page(session, a_url, deal_info, **opts)
+
+        if max_workers <= 1:
+            yield from map(fetch, deal_info_list)
+            return
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                for deal_info in deal_info_list:
+                    pending.append(executor.submit(fetch, deal_info))
+                    if len(pending) >= 2 * max_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # failed page or stopped consumer, pages not started yet are not requested
+                for future in pending:
+                    future.cancel()
+
+    def _fetch_page(self, session, a_url, deal_info, **opts):
+        """
+        :param session: session with site cookies
+        :param a_url: access url dictionary from access-config
+        :param deal_info: deal page details with 'link' and 'params'
+        :param opts: user/commandline inputs
+        :return: parsed page, None when access url has no xpath
+        """
+        provider = opts['provider']
+        link = deal_info['link']
+        params = deal_info['params'] if 'params' in deal_info else {}
+        self._check_deadline(opts, f'{a_url["method"]} - {link}')
+        try:
+            if a_url['method'] == 'POST':
+                res = self._request(session, 'POST', link, provider, opts.get('deadline'), data=params)
+            elif a_url['method'] == 'GET':
+                res = self._request(session, 'GET', link, provider, opts.get('deadline'), params=params)
+        except Exception as e:
+            raise DownloadException('3000_ACCESS_FAILED', e, f'Access failed for {a_url["method"]} - {link}')
+        logging.debug(f'status code :: {res.status_code} history :: {res.history} response URL :: {res.url}')
+        if len(a_url['xpath']) > 0:
+            return self.utils.html_tree(res.content, self._html_parser(provider))
+        return None
 
     def _urls_with_previous_result(self, a_url, links, previous_url_results):
         if 'for_next_url' in a_url['result-url-dict']:
@@ -135,15 +337,90 @@ class FileDownloader(metaclass=abc.ABCMeta):
             return list(map(lambda l: {'link': l}, links))
         return previous_url_results
 
-    def _values_for_next_url(self, a_url, f_html, input_dict=None):
+    def _timeout(self, provider, deadline=None):
+        """
+        :param provider: provider
+        :param deadline: Deadline of the run or None
+        :return: (connect, read) timeout from provider 'http' settings, capped by remaining time of deadline
+        """
+        http_config = HttpClient().http_config(provider)
+        timeout = (http_config['connect-timeout'], http_config['read-timeout'])
+        return deadline.timeout(timeout) if deadline else timeout
+
+    def _retry_policy(self, provider):
+        """
+        :param provider: provider
+        :return: RetryPolicy from provider 'retry' settings in access-config
+        """
+        return RetryPolicy(self.configs.access_config[provider].get('retry') if provider else None)
+
+    def _request(self, session, method, url, provider, deadline=None, **kwargs):
+        """
+        send request with provider timeout, transient failures are retried by provider RetryPolicy and requests stop
+            when circuit breaker of url host is open. Latency and outcome of each attempt are fed to provider
+            ConcurrencyController
+        :param session: requests session
+        :param method: 'GET' or 'POST'
+        :param url: url
+        :param provider: provider
+        :param deadline: Deadline of the run or None
+        :param kwargs: requests arguments (params, data, headers, stream)
+        :return: response
+        """
+        send = session.post if method == 'POST' else session.get
+        controller = self._concurrency(provider)
+
+        def timed_send():
+            started = time.monotonic()
+            try:
+                response = send(url, timeout=self._timeout(provider, deadline), **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if controller:
+                    controller.record(time.monotonic() - started, False)
+                raise
+            if controller:
+                healthy = response.status_code != 429 and response.status_code < 500
+                controller.record(time.monotonic() - started, healthy)
+            return response
+
+        return self._retry_policy(provider).call(timed_send, method, url, deadline)
+
+    def _concurrency(self, provider):
+        """
+        :param provider: provider
+        :return: ConcurrencyController of provider, None when provider concurrency is fixed
+        """
+        access_config = self.configs.access_config.get(provider, {}) if provider else {}
+        initial = self._download_config(provider)['max-workers']
+        return ConcurrencyController.for_provider(provider, access_config, initial)
+
+    def _check_deadline(self, opts, step):
+        """
+        :param opts: user/commandline inputs, opts['deadline'] is Deadline of the run or None
+        :param step: request or step about to start
+        :return: None
+        """
+        if opts.get('deadline'):
+            opts['deadline'].check(step)
+
+    def _html_parser(self, provider):
+        """
+        page source parser for provider, 'html-parser' in access-config, default is fast 'lxml' parser
+        :param provider: provider
+        :return: 'lxml' or 'html5lib'
+        """
+        return self.configs.access_config[provider].get('html-parser', 'lxml')
+
+    def _values_for_next_url(self, a_url, tree, input_dict=None):
         result_dict = input_dict if input_dict else dict(a_url['result-url-dict'])
-        tree = lxml.html.fromstring(f_html)
         key_list = list(a_url['result-url-dict'].keys())[1:]  # Excluding first element, Ex. 'for_next_url'
         for k, xp in zip(key_list, a_url['xpath']):
             try:
-                result_dict[k] = tree.xpath(xp)[0].strip()
+                result_dict[k] = self.configs.xpaths.get(xp)(tree)[0].strip()
             except Exception as e:
-                raise DownloadException('3000_ACCESS_FAILED', e, f'Access failed for xpath: {xp} and source {f_html}')
+                import lxml.html
+                raise DownloadException('3000_ACCESS_FAILED', e, f'Access failed for xpath: {xp} and source '
+                                                                 f'{lxml.html.tostring(tree, encoding="unicode")}')
         return result_dict
 
     def _append_query_str_to_url(self, a_url, user_inputs):
@@ -156,108 +433,445 @@ class FileDownloader(metaclass=abc.ABCMeta):
                 links_with_params.append({'link': a_url['url'], 'params': req_body})
         return links_with_params
 
-    @abc.abstractmethod
     def parse(self, **opts):
         """
-        Step 3:: abstract method, provider specific parsing done in provider downloader class.
+        Step 3:: provider specific parsing of each deal page done in parse_page of provider downloader class.
             Use xpath from access-configs to parse the page source, after method execution a_url['download_urls'] appended
             to opts dictionary
         :param opts: user/commandline inputs + a_url['deal_info_dict_list']
         :return:
         """
+        for a_url in opts['access_urls']:
+            download_urls = list()
+            for deal_info_dict, tree in self._deal_pages(a_url.get('deal_info_dict_list', [])):
+                download_urls += self.parse_page(a_url, deal_info_dict, tree, **opts)
+            a_url['download_urls'] = download_urls
+
+    @abc.abstractmethod
+    def parse_page(self, a_url, deal_info_dict, tree, **opts):
+        """
+        provider specific parsing of one deal page, all xpaths of access url are evaluated against the same tree
+        :param a_url: access url dictionary from access-config
+        :param deal_info_dict: deal page details
+        :param tree: parsed deal page
+        :param opts: user/commandline inputs
+        :return: list of DownloadUrl
+        """
         pass
 
+    def _deal_pages(self, deal_info_dicts):
+        """
+        yields deal pages with parsed tree, each page is parsed only once (tree is cached in deal_info_dict['f_html'])
+            and the tree is released after the page is parsed
+        :param deal_info_dicts: deal page details of access url, a_url['deal_info_dict_list']
+        :return: generator of deal_info_dict and tree
+        """
+        for deal_info_dict in deal_info_dicts:
+            if 'f_html' in deal_info_dict:
+                tree = deal_info_dict['f_html']
+                if isinstance(tree, (str, bytes)):
+                    tree = self.utils.html_tree(tree)
+                yield deal_info_dict, tree
+                del deal_info_dict['f_html']
+
     def filter(self, **opts):
         """
         Step 4:: Use filter/s from user-input-configs and/or from commandline/scheduler and list URLs for file download
-            Using user-input-config download URLs (a_url['download_urls']) filtered and updated
+            Using user-input-config download URLs (a_url['download_urls']) filtered and updated, filtering is done with
+            FilterIndex built once for each access url, 'latest' selects newest month with matching urls
         :param opts: user/commandline inputs + a_url['deal_info_dict_list'] + a_url['download_urls']
         :return: None
         """
-        provider = opts['provider']
         time_span = opts['tspan']
+        filters = self._user_input_config(**opts)['filters']
         for a_url in opts['access_urls']:
             filtered_urls = list()
             if 'download_urls' in a_url and len(a_url['download_urls']) > 0:
-                download_urls = a_url['download_urls']
+                index = FilterIndex(a_url['download_urls'], filters)
                 if time_span == 'latest':
-                    latest = datetime.datetime.now()
-                    while len(filtered_urls) == 0:
-                        time_span = str(latest.month) + '/' + str(latest.year)
-                        filtered_urls = self._filter_urls(provider, download_urls, time_span)
-                        latest = latest + relativedelta(months=-1)
+                    filtered_urls = index.latest(datetime.datetime.now())
                 else:
-                    filtered_urls = self._filter_urls(provider, download_urls, time_span)
+                    filtered_urls = index.select(self.utils.date_range(time_span))
             a_url['download_urls'] = filtered_urls
 
-    def _filter_urls(self, provider, url_dicts, time_span):
+    def _user_input_config(self, **opts):
         """
-        Get provider specific file url for given filter configs and time span
-        :param provider: provider
-        :param url_dicts: having url related information
-        :param time_span: time span
-        :return: filtered urls dictionary list
-        """
-        t_span = self.utils.date_range(time_span)
-        dates = list(map(lambda dt: dt.strftime("%b") + ' ' + str(dt.year), t_span))
-        filters = self.configs.user_input_config[provider]['filters']
-        urls = list()
-        for url_dict in url_dicts:
-            s_data = url_dict.search_data
-            if len(filters) > 0 and len(dates) > 0 \
-                    and len(list(filter(lambda f: s_data.__contains__(f), filters))) == len(filters) \
-                    and len(list(filter(lambda d: s_data.__contains__(d), dates))) > 0:
-                urls.append(url_dict)
-            elif len(filters) == 0 and len(dates) > 0 \
-                    and len(list(filter(lambda d: s_data.__contains__(d), dates))) > 0:
-                urls.append(url_dict)
-        return urls
+        inputs and filters of provider, from profile user-input-config when processed for profile
+        :param opts: user/commandline inputs
+        :return: user input config dictionary with 'input' and 'filters'
+        """
+        user_config = opts['user_input_config'] if 'user_input_config' in opts else None
+        return user_config if user_config else self.configs.user_input_config[opts['provider']]
+
+    def stream(self, session, **opts):
+        """
+        Steps 2 to 5 as one pipeline (opts['stream']), each deal page is parsed as soon as it is received, download
+            urls are filtered while pages are parsed and file download starts with the first matching url. Number of
+            deal pages held in memory and time to the first file do not grow with the number of deals
+            'latest' time span needs all urls of access url to find the newest month, those urls are downloaded after
+            last page of access url is parsed
+        :param session: session with site cookies
+        :param opts: user/commandline inputs
+        :return: None
+        """
+        logging.debug('FileDownloader:stream')
+        self._download_all(session, self._matching_urls(session, **opts), **opts)
+
+    def _matching_urls(self, session, **opts):
+        """
+        :param session: session with site cookies
+        :param opts: user/commandline inputs
+        :return: generator of a_url and DownloadUrl matching user-input-config filters and time span
+        """
+        time_span = opts['tspan']
+        filters = self._user_input_config(**opts)['filters']
+        months = set() if time_span == 'latest' else {(dt.year, dt.month) for dt in self.utils.date_range(time_span)}
+        pages = self.access_pages(session, **opts)
+        for _, a_url_pages in itertools.groupby(pages, key=lambda page: id(page[0])):
+            index = FilterIndex([], filters)
+            for a_url, deal_info_dict in a_url_pages:
+                a_url.setdefault('download_urls', list())
+                for _, tree in self._deal_pages([deal_info_dict]):
+                    for download_url in self.parse_page(a_url, deal_info_dict, tree, **opts):
+                        if index.add(download_url) & months:
+                            a_url['download_urls'].append(download_url)
+                            yield a_url, download_url
+            if time_span == 'latest':
+                a_url['download_urls'] = index.latest(datetime.datetime.now())
+                for download_url in a_url['download_urls']:
+                    yield a_url, download_url
 
     def download_files(self, session, **opts):
         """
         # Step 5::Download files to output directory, using urls and output directory in 'download_url' dictionary
+            files are downloaded by a pool of 'max-workers' threads (access-config 'download' settings) sharing the
+            session cookies, a failed file does not stop the other downloads. Per file results are appended to
+            opts as a_url['download_results']
+            GET request for file recorded in download manifest of output directory by previous runs is conditional
+            on its recorded ETag/Last-Modified and 304 (Not Modified) response skips the download. Recorded files of
+            provider with 'immutable' download setting are skipped without request
+            Files failed with transient errors (connection, timeout, retry status) are downloaded again by deferred
+            retry pass after all other files, 'deferred-delay' of provider 'retry' settings
+            Files not finished before opts['deadline'] are reported with other results and DownloadException 9001 is
+            raised, partially downloaded files are resumed by next run
         :param session: session object site cookies
         :param opts: user/commandline inputs + a_url['deal_info_dict_list'] + a_url['download_urls']
         :return: None
         """
         logging.debug('FileDownloader:Download files')
-        download_count = 0
-        for a_url in opts['access_urls']:
-            if 'download_urls' in a_url:
-                download_urls = a_url['download_urls']
-                for download_url in download_urls:
-                    d_url = download_url.file_url
-                    o_file = download_url.out_file
-                    o_file = self.utils.out_file(d_url, o_file)
-                    if session:
-                        if download_url.method and 'POST' in download_url.method:
-                            response = session.post(d_url, data=download_url.params)
-                        else:
-                            response = session.get(d_url)
-                    else:
-                        response = requests.get(download_url.file_url, stream=True)
-                    self._download(o_file, response)
-                    logging.info(f"[Report: {download_url.report_group}] [{o_file}] downloaded")
-                    download_count += 1
-        if download_count == 0:
+        jobs = [(a_url, download_url) for a_url in opts['access_urls'] if 'download_urls' in a_url
+                for download_url in a_url['download_urls']]
+        if len(jobs) == 0:
             raise DownloadException('6001_FILE_DOWNLOAD_NO_FILE')
+        self._download_all(session, jobs, **opts)
 
-    def _download(self, o_file, response):
+    def _download_all(self, session, jobs, **opts):
         """
-        Download file to output directory, raise exception of login session has expired
-        :param o_file: output file path
+        download files of jobs and append results to opts as a_url['download_results'], see download_files()
+        :param session: session object site cookies
+        :param jobs: list or generator of (a_url, DownloadUrl), downloads start while generator produces next jobs
+        :param opts: user/commandline inputs
+        :return: None
+        """
+        provider = opts.get('provider')
+        download_config = self._download_config(provider)
+        manifest = DownloadManifest(opts['output'], download_config['volatile-params']) if opts.get('output') else None
+        deadline = opts.get('deadline')
+        retry = self._retry_policy(provider)
+        submitted = list()
+
+        def submit(job_iter):
+            for job in job_iter:
+                submitted.append(job)
+                yield job
+
+        try:
+            results = self._download_jobs(session, submit(jobs), download_config, provider, manifest, deadline)
+            if len(results) == 0:
+                raise DownloadException('6001_FILE_DOWNLOAD_NO_FILE')
+            deferred = [i for i, result in enumerate(results) if result.error and retry.transient(result.error)]
+            if deferred and not (deadline and deadline.remaining() < retry.config['deferred-delay']):
+                logging.info(f'Deferred retry of {len(deferred)} failed files')
+                time.sleep(retry.config['deferred-delay'])
+                retried = self._download_jobs(session, [submitted[i] for i in deferred], download_config, provider,
+                                              manifest, deadline)
+                for i, result in zip(deferred, retried):
+                    results[i] = result
+        finally:
+            if manifest:
+                manifest.close()
+        for a_url in opts['access_urls']:
+            a_url['download_results'] = list()
+        for (a_url, _), result in zip(submitted, results):
+            a_url['download_results'].append(result)
+        failed = [result for result in results if result.error]
+        expired = [result for result in failed if result.error.exception_code == '9001_DEADLINE_EXCEEDED']
+        if len(failed) == len(results) and not expired:
+            raise failed[0].error
+        for result in failed:
+            if result not in expired:
+                result.error.log_message()
+        skipped = [result for result in results if result.status == self.STATUS_SKIPPED]
+        logging.info(f'{len(results) - len(failed) - len(skipped)} files downloaded, {len(skipped)} skipped '
+                     f'(already downloaded), {len(failed)} failed')
+        if expired:
+            raise DownloadException('9001_DEADLINE_EXCEEDED',
+                                    custom_message=f'{len(expired)} of {len(results)} files not downloaded before '
+                                                   f'deadline')
+
+    def _download_jobs(self, session, jobs, download_config, provider, manifest, deadline):
+        """
+        files are downloaded by 'max-workers' threads, or by adaptive number of threads when provider has
+            'concurrency' settings
+        :param jobs: list or generator of (a_url, DownloadUrl), each job is submitted as soon as it is generated
+        :return: list of DownloadResult in jobs order
+        """
+        controller = self._concurrency(provider)
+
+        def download(job):
+            job_session = self._session_for(job[1], session)
+            if controller is None:
+                return self._download_file(job_session, job[1], download_config, provider, manifest, deadline)
+            with controller.slot():
+                return self._download_file(job_session, job[1], download_config, provider, manifest, deadline)
+
+        max_workers = controller.max_limit if controller else download_config['max-workers']
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(download, jobs))
+        if controller:
+            controller.save()
+        return results
+
+    def _session_for(self, download_url, session):
+        """
+        :param download_url: DownloadUrl
+        :param session: session of provider run
+        :return: session used to download the file, Bony with session pool downloads on the session which listed it
+        """
+        return session
+
+    def _download_file(self, session, download_url, download_config, provider=None, manifest=None, deadline=None):
+        """
+        Request and download one file, errors are returned as part of result instead of raised
+        :param session: session object site cookies
+        :param download_url: DownloadUrl
+        :param download_config: provider download settings
+        :param provider: provider
+        :param manifest: DownloadManifest of output directory or None
+        :param deadline: Deadline of the run or None
+        :return: DownloadResult
+        """
+        d_url = download_url.file_url
+        o_file = download_url.out_file
+        http_config = HttpClient().http_config(provider)
+        try:
+            if deadline:
+                deadline.check(f'download {d_url}')
+            o_file = self.utils.out_file(d_url, o_file)
+            entry = manifest.downloaded(provider, download_url, o_file) if manifest else None
+            if entry and download_config['immutable']:
+                logging.info(f"[Report: {download_url.report_group}] [{o_file}] already downloaded")
+                return DownloadResult(download_url, o_file, self.STATUS_SKIPPED, None)
+            if download_url.method and 'POST' in download_url.method:
+                # POST downloads are not resumed, request body has one time values (Ex. BONY csrfKey)
+                offset = 0
+                response = self._request(session, 'POST', d_url, provider, deadline, data=download_url.params,
+                                         stream=True)
+            elif download_url.probe and download_url.probe.status_code == 304 and os.path.isfile(o_file):
+                # Conditional probe already confirmed that downloaded file is current
+                logging.info(f"[Report: {download_url.report_group}] [{o_file}] not modified")
+                return DownloadResult(download_url, o_file, self.STATUS_SKIPPED, None)
+            else:
+                headers, offset = self._resume_headers(o_file + self.PART_SUFFIX)
+                if offset == 0 and os.path.isfile(o_file):
+                    # Ask server to send the file only if it has changed since the last download
+                    headers = ValidatorCache.headers(entry) if entry else ValidatorCache().conditional_headers(d_url)
+                # providers without login (FM) download over shared pooled session
+                session = session if session else HttpClient().shared_session(provider)
+                response = self._request(session, 'GET', d_url, provider, deadline, headers=headers, stream=True)
+                if offset > 0 and response.status_code == 416:
+                    # Range of the partial file is rejected (Ex. complete '.part'), download whole file. Retry statuses
+                    # keep the partial file for deferred retry, 200 for changed file is written over it by _download()
+                    logging.info(f'Resume of {o_file} rejected with {response.status_code}, downloading whole file')
+                    response.close()
+                    self._remove(o_file + self.PART_SUFFIX)
+                    self._remove(o_file + self.PART_SUFFIX + self.VALIDATORS_SUFFIX)
+                    offset = 0
+                    headers = ValidatorCache().conditional_headers(d_url) if os.path.isfile(o_file) else {}
+                    response = self._request(session, 'GET', d_url, provider, deadline, headers=headers,
+                                             stream=True)
+                if response.status_code == 304:
+                    response.close()
+                    logging.info(f"[Report: {download_url.report_group}] [{o_file}] not modified")
+                    return DownloadResult(download_url, o_file, self.STATUS_SKIPPED, None)
+            if response.status_code in self._retry_policy(provider).statuses:
+                response.close()
+                raise requests.HTTPError(f'File not available {response.status_code}', response=response)
+            file_info = self._download(o_file, response, download_config['chunk-size'], offset, deadline,
+                                       http_config['min-byte-rate'], http_config['byte-rate-grace'])
+            if not download_url.method or 'POST' not in download_url.method:
+                ValidatorCache().store(d_url, response.headers)
+            if manifest:
+                manifest.record(provider, download_url, o_file, **file_info)
+        except DownloadException as d:
+            return DownloadResult(download_url, o_file, self.STATUS_FAILED, d)
+        except Exception as e:
+            return DownloadResult(download_url, o_file, self.STATUS_FAILED,
+                                  DownloadException('6000_FILE_DOWNLOAD_FAILED', e))
+        logging.info(f"[Report: {download_url.report_group}] [{o_file}] downloaded")
+        return DownloadResult(download_url, o_file, self.STATUS_DOWNLOADED, None)
+
+    def _download_config(self, provider):
+        """
+        provider specific download settings from access-config, missing settings are taken from DOWNLOAD_DEFAULTS
+        :param provider: provider
+        :return: download settings dictionary
+        """
+        access_config = self.configs.access_config.get(provider, {}) if provider else {}
+        return {**self.DOWNLOAD_DEFAULTS, **access_config.get('download', {})}
+
+    def _resume_headers(self, part_file):
+        """
+        Range headers to continue the partial download, If-Range makes server send full file when it has changed
+        :param part_file: partial file path
+        :return: request headers and number of bytes already downloaded
+        """
+        validators = self._load_validators(part_file)
+        offset = os.path.getsize(part_file) if validators and os.path.isfile(part_file) else 0
+        if offset > 0:
+            logging.info(f'Resuming download of {part_file} from byte {offset}')
+            return {'Range': f'bytes={offset}-', 'If-Range': validators['etag'] or validators['last_modified']}, offset
+        return {}, 0
+
+    def _load_validators(self, part_file):
+        try:
+            with open(part_file + self.VALIDATORS_SUFFIX, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_validators(self, part_file, response):
+        """
+        store ETag/Last-Modified of the response, without validators the partial file can't be resumed safely
+        :param part_file: partial file path
         :param response: response
         :return: None
         """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            with open(part_file + self.VALIDATORS_SUFFIX, 'w') as f:
+                json.dump({'etag': etag, 'last_modified': last_modified}, f)
+        else:
+            self._remove(part_file + self.VALIDATORS_SUFFIX)
+
+    def _remove(self, file_path):
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+    def _download(self, o_file, response, chunk_size=DOWNLOAD_DEFAULTS['chunk-size'], offset=0, deadline=None,
+                  min_byte_rate=0, byte_rate_grace=0):
+        """
+        Stream file to output directory in chunks, raise exception of login session has expired
+            body is written to '<o_file>.part' and renamed to o_file only after complete download, so partially
+            written files are never visible under o_file. Partial file is kept with its validators when download
+            breaks, next request for the file continues from the last byte (206) or starts over when server
+            sends full file (200). Download is cancelled when deadline is exceeded or when transfer rate stays below
+            min_byte_rate after byte_rate_grace seconds
+        :param o_file: output file path
+        :param response: streamed response
+        :param chunk_size: number of bytes read and written at a time
+        :param offset: number of bytes requested to skip with Range header
+        :param deadline: Deadline of the run or None
+        :param min_byte_rate: minimal average bytes per second, 0 to disable the check
+        :param byte_rate_grace: seconds before transfer rate is checked
+        :return: dictionary with size, sha256 checksum, etag and last_modified of downloaded file
+        """
+        part_file = o_file + self.PART_SUFFIX
         try:
-            if response.status_code == 200:
-                with open(o_file, 'wb') as output:
-                    output.write(response.content)
+            if response.status_code == 206 and offset > 0:
+                content_range = response.headers.get('Content-Range', '')
+                if not content_range.startswith(f'bytes {offset}-'):
+                    self._remove(part_file)
+                    self._remove(part_file + self.VALIDATORS_SUFFIX)
+                    raise DownloadException('6000_FILE_DOWNLOAD_FAILED',
+                                            custom_message=f'Unexpected range {content_range} for offset {offset}')
+                mode, size = 'ab', offset
+                checksum = self._file_digest(part_file)
+            elif response.status_code == 200:
+                mode, size = 'wb', 0
+                checksum = hashlib.sha256()
             else:
                 raise DownloadException('6000_FILE_DOWNLOAD_FAILED',
                                         custom_message=f'File not available {response.status_code}')
+            self._save_validators(part_file, response)
+            started = time.monotonic()
+            with open(part_file, mode) as output:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        output.write(chunk)
+                        checksum.update(chunk)
+                        size += len(chunk)
+                    if deadline:
+                        deadline.check(f'download {o_file}')
+                    self._check_byte_rate(size - offset, started, min_byte_rate, byte_rate_grace)
+            self._verify_size(response, size)
+            os.replace(part_file, o_file)
+            self._remove(part_file + self.VALIDATORS_SUFFIX)
+            return {'size': size, 'checksum': checksum.hexdigest(), 'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')}
         except Exception as e:
+            if not os.path.isfile(part_file + self.VALIDATORS_SUFFIX):
+                self._remove(part_file)
+            if isinstance(e, DownloadException) and e.exception_code == '9001_DEADLINE_EXCEEDED':
+                raise
             raise DownloadException('6000_FILE_DOWNLOAD_FAILED', e) from None
+        finally:
+            response.close()
+
+    def _check_byte_rate(self, received, started, min_byte_rate, byte_rate_grace):
+        """
+        :param received: number of bytes received by this response
+        :param started: time.monotonic() when transfer started
+        :param min_byte_rate: minimal average bytes per second, 0 to disable the check
+        :param byte_rate_grace: seconds before transfer rate is checked
+        :return: None
+        """
+        elapsed = time.monotonic() - started
+        if min_byte_rate and elapsed > byte_rate_grace and received / elapsed < min_byte_rate:
+            raise DownloadException('6000_FILE_DOWNLOAD_FAILED',
+                                    custom_message=f'Transfer rate {received / elapsed:.0f} bytes/s is below '
+                                                   f'min-byte-rate {min_byte_rate}')
+
+    def _file_digest(self, file_path):
+        """
+        sha256 of the file content, used to continue the checksum of resumed download
+        :param file_path: file path
+        :return: hashlib sha256 object
+        """
+        checksum = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.DOWNLOAD_DEFAULTS['chunk-size']), b''):
+                checksum.update(chunk)
+        return checksum
+
+    def _verify_size(self, response, size):
+        """
+        compare downloaded bytes with Content-Length header (total from Content-Range for resumed download), check
+            is skipped for encoded (gzip etc.) responses because Content-Length is the size of encoded body
+        :param response: response
+        :param size: number of bytes in output file
+        :return: None
+        """
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            content_length = content_range[content_range.rfind('/') + 1:].replace('*', '')
+        else:
+            content_length = response.headers.get('Content-Length')
+        if content_length and response.headers.get('Content-Encoding', 'identity') == 'identity' \
+                and int(content_length) != size:
+            raise DownloadException('6000_FILE_DOWNLOAD_FAILED',
+                                    custom_message=f'Incomplete download {size} of {content_length} bytes')
 
     def file_transfer(self, **opts):
         """
@@ -4,7 +4,9 @@
 """
 __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from common.utils import DownloadUrl
 from download.file_downloader import FileDownloader
@@ -14,29 +16,64 @@ class FMDownloader(FileDownloader):
     """
     FMDownloader class provided the functions for parsing page source code
         parse()  : implementation for fm provider
+        parse_page() : no deal pages, months are probed by parse()
     """
     STR_XML_ = '.xml'
 
+    def parse_page(self, a_url, deal_info_dict, tree, **opts):
+        """
+        FM has no deal pages, download urls of months are built and probed in parse()
+        :return: empty list
+        """
+        return []
+
     def parse(self, **opts):
         """
         method parses the FM specific page source using xpath from access-configs, after method execution
             a_url['download_urls'] appended to opts dictionary
+            Months of time span for all access urls are probed concurrently by 'probe' -> 'max-workers' threads,
+            probe results are cached (AvailabilityCache) so available months are not probed by next runs
         :param opts: user/commandline inputs + a_url['deal_info_dict_list']
         :return:
         """
         logging.debug('FMDownloader:parse')
         time_span = opts['tspan']
         out_dir = opts['output']
+        provider = opts['provider']
         access_urls = opts['access_urls']
-        download_urls = list()
+        probe_workers = self.configs.access_config[provider].get('probe', {}).get('max-workers', 1)
+        tasks = list()
         for a_url in access_urls:
             if time_span == 'latest':
-                download_urls.append(self.utils.latest_url(a_url['url'], out_dir, opts['provider']))
+                tasks.append((a_url, functools.partial(self.utils.latest_url, a_url['url'], out_dir, provider)))
             else:
                 for d in self.utils.date_range(time_span):
-                    f_url = a_url['url'] + d.strftime("%b") + str(d.year) + self.STR_XML_
-                    if self.utils.is_url_exist(f_url):
-                        o_dir = out_dir + '/' + str(d.year) + '-' + str(d.month) + '/' + opts['provider']
-                        o_file = self.utils.out_file(f_url, o_dir)
-                        download_urls.append(DownloadUrl(f_url, o_file, '', str(d.year) + '-' + d.strftime("%b")))
-        a_url['download_urls'] = download_urls
+                    tasks.append((a_url, functools.partial(self._month_url, a_url['url'], d, out_dir, provider,
+                                                           opts.get('deadline'))))
+        with ThreadPoolExecutor(max_workers=probe_workers) as executor:
+            results = list(executor.map(lambda task: task[1](), tasks))
+        for a_url in access_urls:
+            a_url['download_urls'] = list()
+        for (a_url, _), download_url in zip(tasks, results):
+            if download_url:
+                a_url['download_urls'].append(download_url)
+
+    def _month_url(self, url, d, out_dir, provider, deadline=None):
+        """
+        :param url: access url
+        :param d: month
+        :param out_dir: output directory
+        :param provider: provider
+        :param deadline: Deadline of the run or None
+        :return: DownloadUrl of month file, None if file is not available. Month of unknown availability (Ex. 503)
+            is returned for download stage to retry
+        """
+        f_url = url + d.strftime("%b") + str(d.year) + self.STR_XML_
+        if deadline:
+            deadline.check(f'probe {f_url}')
+        probe = self.utils.probe(f_url, cached=True, provider=provider)
+        if probe.exists is not False:
+            o_dir = out_dir + '/' + str(d.year) + '-' + str(d.month) + '/' + provider
+            o_file = self.utils.out_file(f_url, o_dir)
+            return DownloadUrl(f_url, o_file, '', str(d.year) + '-' + d.strftime("%b"), probe=probe)
+        return None
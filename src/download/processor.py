@@ -12,46 +12,42 @@
         transfer files : Transfers the files to desired path (configured in file-transfer-configs)
 """
 __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
+import copy
 import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+from common.deadline import Deadline
 from common.download_exceptions import DownloadException
+from common.http_client import HttpClient
+from common.session_registry import SessionRegistry
 from common.utils import Utils
 from configs.config import Config
-from download.bony_downloader import BonyDownloader
-from download.ct_downloader import CTDownloader
-from download.fm_downloader import FMDownloader
-from download.ubn_downloader import UbnDownloader
-from download.wf_downloader import WFDownloader
-from download.wil_downloader import WilDownloader
+from download.downloader_registry import downloaders
 
 error_logger = logging.getLogger("error_logger")
 
+# succeeded - provider: opts after processing, failed - provider: raised exception
+ProfileResult = namedtuple('ProfileResult', ['profile', 'succeeded', 'failed'])
+
 
 def _get_downloader_obj(provider):
     """
-    downloader factory - generates provider specific downloader object
+    downloader factory - generates provider specific downloader object, provider module is imported on first use
     :param provider: provider
     :return: provider specific downloader object
     """
-    if provider == 'fm':
-        downloader = FMDownloader()
-    elif provider == 'ct':
-        downloader = CTDownloader()
-    elif provider == 'wil':
-        downloader = WilDownloader()
-    elif provider == 'ubn':
-        downloader = UbnDownloader()
-    elif provider == 'wf-wffm':
-        downloader = WFDownloader()
-    elif provider == 'wf-ry':
-        downloader = WFDownloader()
-    elif provider == 'wf-wfeu':
-        downloader = WFDownloader()
-    elif provider == 'bony':
-        downloader = BonyDownloader()
-    else:
-        logging.info(f'No support for provider :: {provider}')
-    return downloader
+    return downloaders.create(provider)
+
+
+def _check_deadline(opts, step):
+    """
+    :param opts: user/commandline inputs, opts['deadline'] is Deadline of the run or None
+    :param step: step about to start
+    :return: None
+    """
+    if opts.get('deadline'):
+        opts['deadline'].check(f'{opts["provider"]} {step}')
 
 
 def validate_n_format(configs, **opts):
@@ -75,28 +71,72 @@ def validate_n_format(configs, **opts):
 def process_profile(**opts):
     """
     process_profile method executes one or more providers listed for desired profile
+        providers are independent, they run concurrently on 'workers' threads (commandline) or 'max-workers' from
+        profile-config, default is one provider at a time. Failure of one provider does not stop the others.
+        Providers on the same portal share one login through SessionRegistry, connections of providers with
+        'preconnect' http setting are opened in background when profile starts. Providers not finished within
+        'deadline' seconds fail with DownloadException 9001
     :param opts:
-    :return:
+    :return: ProfileResult with succeeded and failed providers
     """
     configs = Config()
     profile = opts['profile'].lower()
     opts['output'] += '/' + profile
-    profile_dict = configs.get_config(configs.profile_config[profile]['user-input-config'])
-    for provider, user_input_config in profile_dict.items():
-        logging.info(f'START processing :: profile {profile} for provider {provider}')
-        opts['provider'] = provider
-        opts['user_input_config'] = user_input_config
-        process(**opts)
-        logging.info(f'END processing :: process profile {profile} for provider {provider}')
+    profile_config = configs.profile_config[profile]
+    profile_dict = configs.get_config(profile_config['user-input-config'])
+    max_workers = int(opts.get('workers') or profile_config.get('max-workers', 1))
+    # one deadline for all providers of the profile, 'deadline' seconds from commandline or profile-config
+    deadline = opts.get('deadline') or profile_config.get('deadline')
+    opts['deadline'] = Deadline(deadline) if deadline else None
+    opts['session_registry'] = SessionRegistry()
+    http_client = HttpClient()
+    http_client.preconnect(list(profile_dict))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {provider: executor.submit(_process_provider, provider, user_input_config, dict(opts))
+                       for provider, user_input_config in profile_dict.items()}
+    finally:
+        opts['session_registry'].close()
+        http_client.close()
+    result = ProfileResult(profile, dict(), dict())
+    for provider, future in futures.items():
+        if future.exception():
+            result.failed[provider] = future.exception()
+        else:
+            result.succeeded[provider] = future.result()
+    logging.info(f'Profile {profile} processed :: succeeded {list(result.succeeded)} failed {list(result.failed)}')
+    return result
+
+
+def _process_provider(provider, user_input_config, opts):
+    """
+    execute one provider of the profile
+    :param provider: provider
+    :param user_input_config: provider inputs and filters from profile user-input-config
+    :param opts: copy of user/commandline inputs
+    :return: opts after processing
+    """
+    profile = opts['profile']
+    logging.info(f'START processing :: profile {profile} for provider {provider}')
+    opts['provider'] = provider
+    opts['user_input_config'] = user_input_config
+    result = process(**opts)
+    logging.info(f'END processing :: process profile {profile} for provider {provider}')
+    return result
 
 
 def process(**opts):
     """
-    process method validates inputs and executes all workflow methods for one provider
+    process method validates inputs and executes all workflow methods for one provider, opts['deadline'] (seconds
+        or Deadline shared by profile) is checked before each step and limits request timeouts. With opts['stream']
+        access, parse, filter and download of provider with authentication run as one pipeline (FileDownloader.stream)
     :param opts: user/commandline inputs
-    :return: None
+    :return: opts of the run with a_url['download_results'] of access urls, ProfileResult.succeeded keeps it
     """
     session = None
+    session_registry = opts.get('session_registry')
+    if opts.get('deadline') and not isinstance(opts['deadline'], Deadline):
+        opts['deadline'] = Deadline(opts['deadline'])
     try:
         configs = Config()
         validate_n_format(configs, **opts)
@@ -106,37 +146,57 @@ def process(**opts):
         downloader = _get_downloader_obj(provider)
         auth_config = configs.auth_config[provider]
         access_config = configs.access_config[provider]
-        opts['access_urls'] = access_config['access-url'].copy()
+        configs.xpaths.compile_provider(provider, access_config)
+        # deep copy, access urls are updated with provider results and must not be shared between runs
+        opts['access_urls'] = copy.deepcopy(access_config['access-url'])
         logging.info(f"Retrieval initiated for {provider}")
         if auth_config:
-            # Authenticate and login
-            session, response_dict = downloader.authenticate(provider)
+            _check_deadline(opts, 'authenticate')
+            # Authenticate and login, session is shared with providers of the same portal when registry is available
+            if session_registry:
+                session, response_dict = session_registry.acquire(downloader.session_key(provider),
+                                                                  lambda: downloader.authenticate(provider),
+                                                                  downloader.close_session)
+            else:
+                session, response_dict = downloader.authenticate(provider)
             opts['response_dict'] = response_dict
-            # Access
-            downloader.access(session, **opts)
-            # Parse
-            downloader.parse(**opts)
-            # Filter files for download
-            downloader.filter(**opts)
-            # Download files
-            downloader.download_files(session, **opts)
+            if opts.get('stream'):
+                # Access, parse, filter and download as one pipeline, downloads start with the first matching file
+                _check_deadline(opts, 'stream')
+                downloader.stream(session, **opts)
+            else:
+                # Access
+                _check_deadline(opts, 'access')
+                downloader.access(session, **opts)
+                # Parse
+                _check_deadline(opts, 'parse')
+                downloader.parse(**opts)
+                # Filter files for download
+                downloader.filter(**opts)
+                # Download files
+                _check_deadline(opts, 'download')
+                downloader.download_files(session, **opts)
         else:
             logging.debug(f'Authentication not required for provider :: {provider}')
             # For 'FM' provider, access, parse and filter covered in parse method
+            _check_deadline(opts, 'parse')
             downloader.parse(**opts)
             # Download files
+            _check_deadline(opts, 'download')
             downloader.download_files(session, **opts)
         # Transfer files to desired path
         downloader.file_transfer(**opts)
         logging.info(f"Storage complete for {provider}")
     except DownloadException as u:
         u.log_message()
+        if session and u.exception_code == '3000_ACCESS_FAILED':
+            downloader.discard_cached_session(provider, session)
         raise u
     except Exception as e:
         error_logger.exception(f'0000: ERROR - Unknown exception :: {e}')
         raise e
     finally:
-        # Close session after file download
-        if session:
-            session.close()
+        # Close session after file download, shared sessions are closed by process_profile
+        if session and not session_registry:
+            downloader.close_session(session)
     return opts
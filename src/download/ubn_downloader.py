@@ -6,18 +6,19 @@ __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
 import logging
 
-import lxml.html
-
 from common.download_exceptions import DownloadException
 from common.utils import DownloadUrl
+from common.xpath_registry import xpaths
 from download.file_downloader import FileDownloader
 
 
 class UbnDownloader(FileDownloader):
     """
     UbnDownloader class has functions for parsing page source code
-        parse()  : implementation for 'ubn' provider
+        parse_page()  : implementation for 'ubn' provider
     """
+    # report link and file extension in report cell
+    REPORT_XPATH = xpaths.get('a/@href | a/text()')
 
     def _login_failed(self, provider, response):
         if 'Your user ID or password was invalid' in response.text:
@@ -25,51 +26,46 @@ class UbnDownloader(FileDownloader):
         else:
             return False
 
-    def parse(self, **opts):
+    def parse_page(self, a_url, deal_info_dict, tree, **opts):
         """
-        method parses the 'ubn' specific page source using xpath from access-configs, after method execution
-            a_url['download_urls'] appended to opts dictionary
-        :param opts: user/commandline inputs + a_url['deal_info_dict_list']
-        :return:
+        method parses the 'ubn' specific page source using xpath from access-configs
+        :param a_url: access url dictionary from access-config
+        :param deal_info_dict: deal page details
+        :param tree: parsed deal page
+        :param opts: user/commandline inputs
+        :return: list of DownloadUrl
         """
         logging.debug('UbnDownloader:parse')
         provider = opts['provider']
         out_dir = opts['output']
-        access_config = self.configs.access_config[provider]
-        site_url = access_config['site-url']
-        for a_url in opts['access_urls']:
-            download_urls = list()
-            for xpath in a_url['xpath']:
-                for deal_info_dict in a_url['deal_info_dict_list']:
-                    if 'f_html' in deal_info_dict:
-                        tree = lxml.html.fromstring(deal_info_dict['f_html'])
-                        try:
-                            tr = tree.xpath(xpath)
-                        except Exception as e:
-                            raise DownloadException('4000_PARSING_FAILED', e)
+        site_url = self.configs.access_config[provider]['site-url']
+        download_urls = list()
+        for xpath in a_url['xpath']:
+            try:
+                tr = self.configs.xpaths.get(xpath)(tree)
+            except Exception as e:
+                raise DownloadException('4000_PARSING_FAILED', e)
+            search_data = ''
+            yyyy_mon = ''
+            for td in tr:
+                td_txt = (td.text or '').strip()
+                if td_txt:
+                    if 'Investor Report' in td_txt:
                         search_data = ''
-                        yyyy_mon = ''
-                        for td in tr:
-                            td_txt = td.text.strip()
-                            if td_txt:
-                                if 'Investor Report' in td_txt:
-                                    search_data = ''
-                                    search_data += td_txt + '||'
-                                else:
-                                    dt = self.utils.validate_date(td_txt)
-                                    if dt[0]:
-                                        yyyy_mon = str(dt[1].year) + '-' + str(dt[1].month)
-                                        search_data += dt[1].strftime("%b") + ' ' + str(dt[1].year) + '||'
-                                    else:
-                                        search_data += td_txt + '||'
-                            w_td = td.xpath('a/@href | a/text()')
-                            for href, a_text in zip(*[iter(w_td)] * 2):
-                                logging.debug(f'href:: {href} a_text:: {a_text}')
-                                f_url = site_url + href.strip()
-                                o_file = out_dir + '/' + yyyy_mon + '/' + provider + '/' + deal_info_dict['dealName']
-                                o_file += '/' + deal_info_dict['dealName'] + '-Investor-Report-' + yyyy_mon
-                                o_file += '.' + a_text.strip()
-                                download_urls.append(
-                                    DownloadUrl(f_url, o_file, search_data, deal_info_dict['dealName']))
-                # del a_url['f_html']
-                a_url['download_urls'] = download_urls
+                        search_data += td_txt + '||'
+                    else:
+                        dt = self.utils.validate_date(td_txt)
+                        if dt[0]:
+                            yyyy_mon = str(dt[1].year) + '-' + str(dt[1].month)
+                            search_data += dt[1].strftime("%b") + ' ' + str(dt[1].year) + '||'
+                        else:
+                            search_data += td_txt + '||'
+                w_td = self.REPORT_XPATH(td)
+                for href, a_text in zip(*[iter(w_td)] * 2):
+                    logging.debug(f'href:: {href} a_text:: {a_text}')
+                    f_url = site_url + href.strip()
+                    o_file = out_dir + '/' + yyyy_mon + '/' + provider + '/' + deal_info_dict['dealName']
+                    o_file += '/' + deal_info_dict['dealName'] + '-Investor-Report-' + yyyy_mon
+                    o_file += '.' + a_text.strip()
+                    download_urls.append(DownloadUrl(f_url, o_file, search_data, deal_info_dict['dealName']))
+        return download_urls
@@ -5,59 +5,56 @@
 import logging
 import re
 
-import lxml.html
-
 from common.utils import DownloadUrl
+from common.xpath_registry import xpaths
 from download.file_downloader import FileDownloader
 
 
 class WilDownloader(FileDownloader):
     """
     WilmingtonDownloader class has functions for parsing page source code
-        parse()  : implementation for 'wil' provider
+        parse_page()  : implementation for 'wil' provider
     """
+    # RegEx for dd-mon-YYYY
+    DATE_PATTERN = re.compile(r'^(\d{1,2})(\/|-)([a-zA-Z]{3})(\/|-)(\d{2})$')
+    # snapshot link and deal name in deal cell
+    SNAPSHOT_XPATH = xpaths.get('a/@href | a/text()')
 
-    def parse(self, **opts):
+    def parse_page(self, a_url, deal_info_dict, tree, **opts):
         """
-        method parses the 'wil' specific page source using xpath from access-configs, after method execution
-            a_url['download_urls'] appended to opts dictionary
-        :param opts: user/commandline inputs + a_url['deal_info_dict_list']
-        :return:
+        method parses the 'wil' specific page source using xpath from access-configs
+        :param a_url: access url dictionary from access-config
+        :param deal_info_dict: deal page details
+        :param tree: parsed deal page
+        :param opts: user/commandline inputs
+        :return: list of DownloadUrl
         """
-        logging.info('WilmingtonDownloader:parse')
-        # RegEx for dd-mon-YYYY
-        pattern = re.compile('^(\d{1,2})(\/|-)([a-zA-Z]{3})(\/|-)(\d{2})$')
+        logging.debug('WilmingtonDownloader:parse')
         provider = opts['provider']
         out_dir = opts['output']
-        access_config = self.configs.access_config[provider]
-        site_url = access_config['site-url']
-        for a_url in opts['access_urls']:
-            download_urls = list()
-            for xpath in a_url['xpath']:
-                for deal_info_dict in a_url['deal_info_dict_list']:
-                    if 'f_html' in deal_info_dict:
-                        tree = lxml.html.fromstring(deal_info_dict['f_html'])
-                        tr = tree.xpath(xpath)
-                        s_data = ''
-                        f_url = ''
-                        o_dir = ''
-                        dt_str = ''
-                        for td in tr:
-                            td_txt = td.text.strip()
-                            if td_txt:
-                                # This Date conversion is for Search criteria
-                                if pattern.match(td_txt):
-                                    m = pattern.search(td_txt)
-                                    # receiving year as YY, 20 Hard coded to make YYYY, assuming data is 2000 onwards
-                                    s_data += m.group(3) + ' 20' + m.group(5) + '||'
-                                    dt_str = m.group(3) + m.group(5)
-                                else:
-                                    s_data += td_txt + '||'
-                            w_td = td.xpath('a/@href | a/text()')
-                            for href, a_text in zip(*[iter(w_td)] * 2):
-                                logging.debug(f'href:: {href} a_text:: {a_text}')
-                                f_url = site_url + href.strip().replace('Snapshot', 'ExportSnapshotData')
-                                o_dir = out_dir + '/' + provider + '/' + a_text.strip()
-                        download_urls.append(DownloadUrl(f_url, o_dir + '/' + dt_str + '.xlsx', s_data, ''))
-                # del a_url['f_html']
-                a_url['download_urls'] = download_urls
+        site_url = self.configs.access_config[provider]['site-url']
+        download_urls = list()
+        for xpath in a_url['xpath']:
+            tr = self.configs.xpaths.get(xpath)(tree)
+            s_data = ''
+            f_url = ''
+            o_dir = ''
+            dt_str = ''
+            for td in tr:
+                td_txt = (td.text or '').strip()
+                if td_txt:
+                    # This Date conversion is for Search criteria
+                    if self.DATE_PATTERN.match(td_txt):
+                        m = self.DATE_PATTERN.search(td_txt)
+                        # receiving year as YY, 20 Hard coded to make YYYY, assuming data is 2000 onwards
+                        s_data += m.group(3) + ' 20' + m.group(5) + '||'
+                        dt_str = m.group(3) + m.group(5)
+                    else:
+                        s_data += td_txt + '||'
+                w_td = self.SNAPSHOT_XPATH(td)
+                for href, a_text in zip(*[iter(w_td)] * 2):
+                    logging.debug(f'href:: {href} a_text:: {a_text}')
+                    f_url = site_url + href.strip().replace('Snapshot', 'ExportSnapshotData')
+                    o_dir = out_dir + '/' + provider + '/' + a_text.strip()
+            download_urls.append(DownloadUrl(f_url, o_dir + '/' + dt_str + '.xlsx', s_data, ''))
+        return download_urls
@@ -8,8 +8,10 @@
 __author__ = 'Dattatraya Tembare<tembare.datta@gmail.com>'
 
 import logging
+import sys
 from optparse import OptionParser
 
+from download.processor import ProfileResult
 from download.processor import process
 from download.processor import process_profile
 
@@ -24,11 +26,12 @@ class FileRetriever:
         retriever() checks the basic parameters availability and gives call to processor or process_profile
         Basic requirement is input combination of 'provider' and 'output' OR 'profile' and 'output'
             If all 4 input parameters provided then 'process_profile' execution starts
-        :param opts: dictionary with 4 elements (output, provider, profile and tspan)
-        :return: None
+        :param opts: dictionary with 4 elements (output, provider, profile and tspan) and optional workers, deadline,
+            stream
+        :return: opts for provider or ProfileResult for profile
         """
         if opts['profile'] and opts['output']:
-            process_profile(**opts)
+            return process_profile(**opts)
         elif opts['provider'] and opts['output']:
             return process(**opts)
         else:
@@ -45,6 +48,10 @@ def main() -> object:
         profile  : profile is user who is responsible to download the files for multiple providers,
                     required if provider is not provided
         tspan    : Time span, it can be 'latest'(default) or 'mm/yyyy' or 'mm/yyyy-mm/yyyy'
+        workers  : Number of profile providers processed in parallel, overrides 'max-workers' from profile-config
+        deadline : Seconds allowed for the whole run, overrides 'deadline' from profile-config
+        stream   : Download files while deal pages are still accessed and parsed
+    Exits with status 1 when any provider of the profile failed
 
     :return:
     """
@@ -53,13 +60,24 @@ def main() -> object:
     parser.add_option("-s", "--provider", default=None, dest="provider", help="Provider provider", metavar="PROVIDER")
     parser.add_option("-p", "--profile", default=None, dest="profile", help="Profile name", metavar="PROFILE")
     parser.add_option("-t", "--tspan", default='latest', dest="tspan", help="Time span in mm/yyyy", metavar="DURATION")
+    parser.add_option("-w", "--workers", default=None, type="int", dest="workers",
+                      help="Providers processed in parallel for profile", metavar="WORKERS")
+    parser.add_option("-d", "--deadline", default=None, type="float", dest="deadline",
+                      help="Seconds allowed for the whole run", metavar="SECONDS")
+    parser.add_option("-r", "--stream", action="store_true", default=False, dest="stream",
+                      help="Download files while deal pages are parsed")
 
     opts, args = parser.parse_args()
     logging.debug(f'opts: {opts} args: {args}')
     opts_dict = vars(opts)
     # Download Files
     d = FileRetriever()
-    d.retrieve(**opts_dict)
+    result = d.retrieve(**opts_dict)
+    # failed providers of profile are collected, scheduler gets non-zero exit status
+    if isinstance(result, ProfileResult) and result.failed:
+        for provider, error in result.failed.items():
+            logging.error(f'Profile {result.profile} provider {provider} failed :: {error}')
+        sys.exit(1)
 
 
 if __name__ == '__main__':
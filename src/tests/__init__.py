@@ -0,0 +1,19 @@
+import os
+import tempfile
+from unittest import mock
+
+# Keep caches written by tests out of the configured cache-dir
+os.environ.setdefault('FILE_DOWNLOADER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'file_downloader_tests'))
+
+from common.retry import RetryPolicy  # noqa: E402
+
+# Retry settings of tests which reach portals, unreachable portals fail fast instead of waiting production delays
+NO_BACKOFF = {'backoff': 0, 'max-backoff': 0, 'jitter': 0, 'deferred-delay': 0}
+
+
+def no_backoff(**retry_config):
+    """
+    :param retry_config: other RetryPolicy defaults of the test (Ex. attempts)
+    :return: patcher of RetryPolicy defaults without backoff, jitter and deferred retry delay
+    """
+    return mock.patch.dict(RetryPolicy.RETRY_DEFAULTS, {**NO_BACKOFF, **retry_config})
@@ -0,0 +1,91 @@
+import datetime
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+from common.cache import AvailabilityCache, PersistentCache, SessionCache
+from common.probe import Prober
+from common.retry import RetryPolicy
+from common.utils import Utils
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        """Call before every test case."""
+        self.cache = PersistentCache('tests-' + uuid.uuid4().hex)
+
+    def test_set_get(self):
+        self.cache.set('key', {'value': 1})
+        self.assertEqual({'value': 1}, self.cache.get('key'))
+
+    def test_expired_entry(self):
+        self.cache.set('key', {'value': 1}, ttl=-1)
+        self.assertEqual('default', self.cache.get('key', 'default'))
+
+    def test_delete(self):
+        self.cache.set('key', {'value': 1})
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_available_file_probed_once(self):
+        url = f'https://fm.test/LoanLevel01Jan2015-{uuid.uuid4().hex}.xml'
+        session = FakeHeadSession(200)
+        with mock.patch('common.utils.Prober', return_value=Prober(session)):
+            self.assertTrue(Utils().probe(url, cached=True).exists)
+            self.assertTrue(Utils().probe(url, cached=True).exists)
+        self.assertEqual(1, session.count, 'Available file should be probed only once')
+
+    def test_not_modified_cached_as_available(self):
+        url = f'https://fm.test/LoanLevel01Feb2015-{uuid.uuid4().hex}.xml'
+        with mock.patch('common.utils.Prober', return_value=Prober(FakeHeadSession(304))):
+            self.assertEqual(304, Utils().probe(url, cached=True).status_code)
+            self.assertEqual(200, Utils().probe(url, cached=True).status_code)
+
+    def test_missing_file_cached_for_negative_ttl(self):
+        url = f'https://fm.test/LoanLevel01Mar2015-{uuid.uuid4().hex}.xml'
+        with mock.patch('common.utils.Prober', return_value=Prober(FakeHeadSession(404))):
+            self.assertFalse(Utils().probe(url, cached=True).exists)
+        self.assertEqual(False, AvailabilityCache().get(url)['exists'])
+        AvailabilityCache().set(url, AvailabilityCache().get(url), ttl=-1)
+        self.assertIsNone(AvailabilityCache().get(url), 'Expired negative entry should be probed again')
+
+    def test_unknown_availability_not_cached(self):
+        url = f'https://unavailable.test/LoanLevel01-{uuid.uuid4().hex}-'
+        prober = Prober(FakeHeadSession(503), RetryPolicy({'attempts': 1}))
+        with mock.patch('common.utils.Prober', return_value=prober), tempfile.TemporaryDirectory() as out_dir:
+            latest = Utils().latest_url(url, out_dir, 'fm', datetime.datetime(2015, 4, 1))
+        self.assertEqual(url + 'Apr2015.xml', latest.file_url, 'Unavailable portal should not skip to older month')
+        self.assertIsNone(latest.probe.exists)
+        self.assertIsNone(AvailabilityCache().get(latest.file_url), 'Retry status should not be cached')
+
+    @unittest.skipUnless(SessionCache().enabled, 'cryptography package is not installed')
+    def test_session_cookies_encrypted(self):
+        key = 'tests:' + uuid.uuid4().hex
+        cookies = [{'name': 'JSESSIONID', 'value': 'secret-session', 'domain': 'bony.com', 'path': '/',
+                    'secure': True, 'expires': None}]
+        SessionCache().save(key, cookies, 60)
+        self.assertEqual(cookies, SessionCache().load(key))
+        self.assertNotIn('secret-session', SessionCache().get(key), 'Cookies should be stored encrypted')
+
+    def test_session_not_decrypted_removed(self):
+        key = 'tests:' + uuid.uuid4().hex
+        SessionCache().set(key, 'not-a-token', 60)
+        self.assertIsNone(SessionCache().load(key))
+
+
+class FakeHeadSession:
+    """Session answering HEAD with prepared status code"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.count = 0
+
+    def head(self, url, headers=None, **kwargs):
+        self.count += 1
+        return type('FakeResponse', (), {'status_code': self.status_code, 'headers': {}})()
+
+
+if __name__ == '__main__':
+    unittest.main()
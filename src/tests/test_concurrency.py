@@ -0,0 +1,64 @@
+import unittest
+import uuid
+
+from common.cache import PersistentCache
+from common.concurrency import ConcurrencyController
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+    def setUp(self):
+        """Call before every test case."""
+        # every test has own provider, limits are persisted between runs
+        self.provider = 'tests-' + uuid.uuid4().hex
+        self.controller = ConcurrencyController(self.provider, {'max': 8, 'window': 4, 'cooldown': 0}, 2)
+
+    def test_additive_increase(self):
+        for _ in range(2):
+            self.controller.record(0.1, True)
+        self.assertEqual(2, self.controller.limit)
+        for _ in range(3):
+            self.controller.record(0.1, True)
+        self.assertEqual(3, self.controller.limit, 'Limit should grow by one after about limit healthy responses')
+
+    def test_multiplicative_decrease(self):
+        self.controller = ConcurrencyController(self.provider, {'max': 8, 'cooldown': 0}, 8)
+        self.controller.record(0.1, False)
+        self.assertEqual(4, self.controller.limit)
+        self.controller.record(0.1, False)
+        self.controller.record(0.1, False)
+        self.controller.record(0.1, False)
+        self.assertEqual(1, self.controller.limit, 'Limit should not go below min')
+
+    def test_rising_latency_decreases(self):
+        self.controller = ConcurrencyController(self.provider, {'max': 8, 'window': 4, 'cooldown': 0}, 6)
+        for latency in [0.1, 0.1, 0.1, 0.1]:
+            self.controller.record(latency, True)
+        limit = self.controller.limit
+        for latency in [0.5, 0.5, 0.5, 0.5]:
+            self.controller.record(latency, True)
+        self.assertLess(self.controller.limit, limit)
+
+    def test_limit_recovers_from_fast_baseline(self):
+        PersistentCache('concurrency').set(self.provider, {'limit': 8, 'p95': 0.2})
+        self.controller = ConcurrencyController(self.provider, {'max': 8, 'cooldown': 0}, 8)
+        for _ in range(200):
+            self.controller.record(0.5, True)
+        self.assertEqual(8, self.controller.limit, 'Steady latency above fast baseline of previous run should recover')
+
+    def test_limit_persisted(self):
+        self.controller.record(0.1, False)
+        self.controller.save()
+        self.assertEqual(1, ConcurrencyController(self.provider, {}, 6).limit, 'Next run should start from saved limit')
+
+    def test_slot_respects_limit(self):
+        with self.controller.slot(), self.controller.slot():
+            self.assertEqual(2, self.controller._in_flight)
+        self.assertEqual(0, self.controller._in_flight)
+
+    def test_provider_without_settings(self):
+        self.assertIsNone(ConcurrencyController.for_provider('fm', {'download': {'max-workers': 2}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,29 @@
+import copy
 import datetime
+import json
 import os
+import shutil
+import threading
+import time
 import unittest
+import uuid
 from collections import namedtuple
+from unittest import mock
 
+import requests
 from dateutil.relativedelta import relativedelta
 
+from common.cache import DealCache, SessionCache, ValidatorCache
+from common.deadline import Deadline
 from common.download_exceptions import DownloadException
+from common.retry import RetryPolicy
 from common.utils import DownloadUrl
+from download.bony_downloader import BonyDownloader
 from download.ct_downloader import CTDownloader
+from download.file_downloader import FileDownloader
 from download.fm_downloader import FMDownloader
 from download.ubn_downloader import UbnDownloader
+from tests import no_backoff
 
 
 class TestFileDownloader(unittest.TestCase):
@@ -20,6 +34,7 @@ class TestFileDownloader(unittest.TestCase):
 
     def tearDown(self):
         """tear down"""
+        shutil.rmtree(self._out_dir + '/stream', ignore_errors=True)
 
     def test_login_failed_ct(self):
         print('Test: CT - Testing login failure check')
@@ -36,6 +51,212 @@ class TestFileDownloader(unittest.TestCase):
         self.assertTrue(
             downloader._login_failed("ct", Response('<html>Your user ID or password was invalid</html>')))
 
+    @unittest.skipUnless(SessionCache().enabled, 'cryptography package is not installed')
+    def test_authenticate_reuses_cached_session(self):
+        print('Test: CT - Reusing cached session')
+        downloader = CTDownloader()
+        SessionCache().save(downloader.session_key('ct'),
+                            [{'name': 'JSESSIONID', 'value': 'warm', 'domain': 'sf.ct.com', 'path': '/', 'secure': True,
+                              'expires': None}], 60)
+        Response = namedtuple('Response', 'status_code text history url')
+        check = Response(200, 'batch download', [], 'https://sf.ct.com/stfin/jsp/batchdownload.jsp')
+        with mock.patch.object(requests.Session, 'get', return_value=check) as get, \
+                mock.patch.object(requests.Session, 'post', side_effect=AssertionError('login not expected')):
+            session, response_dict = downloader.authenticate('ct')
+        get.assert_called_once()
+        self.assertEqual(('https://sf.ct.com/stfin/jsp/batchdownload.jsp',), get.call_args.args)
+        self.assertEqual('warm', session.cookies.get('JSESSIONID'))
+        downloader.discard_cached_session('ct', session)
+        self.assertIsNone(SessionCache().load(downloader.session_key('ct')), 'Access failed on cached session')
+
+    @unittest.skipUnless(SessionCache().enabled, 'cryptography package is not installed')
+    def test_session_not_cached_without_check_url(self):
+        print('Test: Bony - Session is not cached when provider has no authenticated page to check it')
+        downloader = BonyDownloader()
+        access_config = downloader.configs.access_config['bony']
+        with mock.patch.dict(access_config, {'session-cache': {'ttl': 60}}), \
+                mock.patch.object(requests.Session, 'get', side_effect=AssertionError('check not expected')):
+            downloader._cache_session('bony', requests.Session())
+            self.assertIsNone(SessionCache().load(downloader.session_key('bony')))
+            self.assertIsNone(downloader._cached_session('bony'))
+
+    def test_access_fetches_inputs_concurrently_in_order(self):
+        print('Test: UBN - Deal pages of input list are requested concurrently and chained in input order')
+        cusips = ['c' + str(i) for i in range(8)]
+        deal_url = {'url': 'https://ubn.test/deal', 'method': 'GET', 'input-param': {'view': 'deal'},
+                    'xpath': ['//p/text()'], 'result-url-dict': {'for_next_url': 'True', 'dealId': ''}}
+        report_url = {'url': 'https://ubn.test/report/{dealId}', 'method': 'GET', 'input-param': {}, 'xpath': ['//p'],
+                      'result-url-dict': {}}
+        session = PageSession()
+        UbnDownloader().access(session, access_urls=[deal_url, report_url], provider='ubn',
+                               user_input_config={'input': {'cusip': cusips}, 'filters': []})
+        self.assertEqual(['https://ubn.test/report/' + cusip for cusip in cusips],
+                         [d['link'] for d in report_url['deal_info_dict_list']])
+        self.assertEqual(cusips, [d['f_html'].findtext('.//p') for d in report_url['deal_info_dict_list']])
+        self.assertGreater(session.max_in_flight, 1, 'ubn access max-workers should request pages concurrently')
+
+    def test_bony_session_pool_runs_csrf_chains_in_parallel(self):
+        print('Test: BONY - Deal inputs are split between pool sessions, each with own csrfKey chain')
+        # new cusips for every run, searched deals are cached
+        cusips = [uuid.uuid4().hex for _ in range(7)]
+        downloader = BonyDownloader()
+        sessions = [BonySession(str(i)) for i in range(3)]
+        logins = [(session, {'csrfKey': session.csrf_key}) for session in sessions[1:]]
+        opts = self._bony_opts(cusips)
+        with mock.patch.object(downloader, '_login', side_effect=logins):
+            downloader.access(sessions[0], **opts)
+        deal_pages = opts['access_urls'][1]['deal_info_dict_list']
+        self.assertEqual(['Deal ' + cusip for cusip in cusips], [d['deal_info']['deal_name'] for d in deal_pages])
+        self.assertEqual([6, 6, 2], [s.requests for s in sessions], 'Three cusips per session, search and reports')
+        download_url = DownloadUrl('u', 'o', '', 'Deal', {'csrfKey': deal_pages[6]['for_next_params']['csrfKey']})
+        self.assertIs(sessions[2], downloader._session_for(download_url, sessions[0]))
+        downloader.close_session(sessions[0])
+        self.assertEqual([True, True, True], [s.closed for s in sessions])
+        for cusip in cusips:
+            DealCache().delete(cusip)
+
+    def test_bony_cached_deal_skips_search(self):
+        print('Test: BONY - Deal number of searched CUSIP is cached and next run skips the search request')
+        cusip = uuid.uuid4().hex
+        for run in range(2):
+            session = BonySession('0')
+            opts = self._bony_opts([cusip])
+            BonyDownloader().access(session, **opts)
+            deal_page = opts['access_urls'][1]['deal_info_dict_list'][0]
+            self.assertEqual('Deal ' + cusip, deal_page['deal_info']['deal_name'])
+            self.assertEqual(2 - run, session.requests, 'Cached deal should request only deal reports')
+        DealCache().delete(cusip)
+
+    def test_bony_failed_deal_reports_deletes_cached_deal(self):
+        print('Test: BONY - Cached deal is deleted when its deal reports request fails')
+        cusip = uuid.uuid4().hex
+        DealCache().store(cusip, 'stale', 'Deal stale')
+        with self.assertRaises(DownloadException) as d:
+            BonyDownloader().access(BonySession('0', fail_reports=True), **self._bony_opts([cusip]))
+        self.assertEqual('3000_ACCESS_FAILED', d.exception.exception_code)
+        self.assertIsNone(DealCache().get(cusip))
+
+    def test_bony_report_pages_follow_csrf_chain(self):
+        print('Test: BONY - Report listing pages are requested along csrfKey chain and parsed with the first page')
+        cusips = [uuid.uuid4().hex, uuid.uuid4().hex]
+        session = BonySession('0', report_pages=4)
+        opts = self._bony_opts(cusips)
+        downloader = BonyDownloader()
+        # one session, both deals in one chain
+        with mock.patch.object(downloader, '_login_pool', return_value=[]):
+            downloader.access(session, **opts)
+        deal_page = opts['access_urls'][1]['deal_info_dict_list'][0]
+        self.assertEqual(['page 1', 'page 2', 'page 3', 'page 4'],
+                         [row.findtext('td') for row in deal_page['f_html'][0]])
+        self.assertEqual({'100'}, session.records_per_page)
+        self.assertEqual(10, session.requests, 'One search and four report pages for each deal')
+        for cusip in cusips:
+            DealCache().delete(cusip)
+
+    def _bony_opts(self, cusips):
+        return {'access_urls': copy.deepcopy(BonyDownloader().configs.access_config['bony']['access-url']),
+                'provider': 'bony', 'response_dict': {'csrfKey': '0-0'},
+                'user_input_config': {'input': {'hd_search_for': cusips}, 'filters': []}}
+
+    def test_downloader_without_parse_page(self):
+        print('Test: Downloader without parse_page can not be created')
+
+        class NoParser(FileDownloader):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoParser()
+
+    def test_parse_ct(self):
+        print('Test: CT - Parsing page source')
+        page = b'<html><body><div><div><div><table><tr><td><form><table></table><table></table><table><tr><td>' \
+               b'Certificate Holders Statement<a href="/stfin/f1.pdf">Report A</a>' \
+               b'<span>(Distribution Date Nov 2018)</span></td></tr></table></form></td></tr></table>' \
+               b'</div></div></div></body></html>'
+        downloader = CTDownloader()
+        access_urls = [dict(downloader.configs.access_config['ct']['access-url'][0])]
+        access_urls[0]['deal_info_dict_list'] = [{'f_html': downloader.utils.html_tree(page)}]
+        downloader.parse(access_urls=access_urls, provider='ct', output=self._out_dir)
+        download_url = access_urls[0]['download_urls'][0]
+        self.assertEqual('https://sf.ct.com/stfin/f1.pdf', download_url.file_url)
+        self.assertEqual('Report A || (Distribution Date Nov 2018) || Certificate Holders Statement',
+                         download_url.search_data)
+        self.assertNotIn('f_html', access_urls[0]['deal_info_dict_list'][0], 'Parsed page is not released')
+
+    def test_filter_time_span(self):
+        print('Test: CT - Filter download urls for time span')
+        statement = 'Certificate Holders Statement'
+        download_urls = [DownloadUrl('u1', 'o1', 'Report A || (Distribution Date Oct 2018) || ' + statement),
+                         DownloadUrl('u2', 'o2', 'Report B || (Distribution Date Nov 2018) || Other Statement'),
+                         DownloadUrl('u3', 'o3', 'Report C || (Distribution Date Nov 2018) || ' + statement)]
+        access_urls = [{'download_urls': download_urls}]
+        CTDownloader().filter(access_urls=access_urls, provider='ct', tspan='9/2018-11/2018')
+        self.assertEqual(['u1', 'u3'], [d.file_url for d in access_urls[0]['download_urls']])
+
+    def test_filter_latest(self):
+        print('Test: CT - Filter download urls for latest month')
+        statement = 'Certificate Holders Statement'
+        download_urls = [DownloadUrl('u1', 'o1', 'Report A || (Distribution Date Oct 2018) || ' + statement),
+                         DownloadUrl('u2', 'o2', 'Report B || (Distribution Date Nov 2018) || ' + statement),
+                         DownloadUrl('u3', 'o3', 'Report C || (Distribution Date Jan 2999) || ' + statement)]
+        access_urls = [{'download_urls': download_urls}, {'download_urls': [DownloadUrl('u4', 'o4', 'no month')]}]
+        CTDownloader().filter(access_urls=access_urls, provider='ct', tspan='latest')
+        self.assertEqual(['u2'], [d.file_url for d in access_urls[0]['download_urls']])
+        self.assertEqual([], access_urls[1]['download_urls'])
+
+    def test_stream_downloads_before_last_page(self):
+        print('Test: CT - Streaming pipeline downloads first matching file before next deal page is accessed')
+        downloader = CTDownloader()
+        requested = threading.Event()
+        session = FakeSession({'https://sf.ct.com/stfin/f1.pdf': FakeResponse(200, [b'first']),
+                               'https://sf.ct.com/stfin/f2.pdf': FakeResponse(200, [b'second'])})
+        get = session.get
+
+        def get_and_signal(url, **kwargs):
+            requested.set()
+            return get(url, **kwargs)
+
+        def access_pages(_, **opts):
+            a_url = opts['access_urls'][0]
+            yield a_url, {'f_html': downloader.utils.html_tree(self._ct_page('/stfin/f1.pdf', 'Nov 2018'))}
+            self.assertTrue(requested.wait(5), 'First file should be requested before next page is accessed')
+            yield a_url, {'f_html': downloader.utils.html_tree(self._ct_page('/stfin/f2.pdf', 'Nov 2018'))}
+            yield a_url, {'f_html': downloader.utils.html_tree(self._ct_page('/stfin/f3.pdf', 'Oct 2018'))}
+
+        session.get = get_and_signal
+        opts = self._ct_stream_opts(downloader, '11/2018')
+        with mock.patch.object(downloader, 'access_pages', side_effect=access_pages):
+            downloader.stream(session, **opts)
+        a_url = opts['access_urls'][0]
+        self.assertEqual(['https://sf.ct.com/stfin/f1.pdf', 'https://sf.ct.com/stfin/f2.pdf'],
+                         [d.file_url for d in a_url['download_urls']])
+        self.assertEqual(['downloaded', 'downloaded'], [r.status for r in a_url['download_results']])
+
+    def test_stream_latest(self):
+        print('Test: CT - Streaming pipeline selects latest month after access url is parsed')
+        downloader = CTDownloader()
+        session = FakeSession({'https://sf.ct.com/stfin/f2.pdf': FakeResponse(200, [b'latest'])})
+        pages = [self._ct_page('/stfin/f1.pdf', 'Oct 2018'), self._ct_page('/stfin/f2.pdf', 'Nov 2018')]
+        opts = self._ct_stream_opts(downloader, 'latest')
+        a_url = opts['access_urls'][0]
+        page_iter = iter([(a_url, {'f_html': page}) for page in pages])
+        with mock.patch.object(downloader, 'access_pages', return_value=page_iter):
+            downloader.stream(session, **opts)
+        self.assertEqual(['https://sf.ct.com/stfin/f2.pdf'], [d.file_url for d in a_url['download_urls']])
+        self.assertEqual(['downloaded'], [r.status for r in a_url['download_results']])
+
+    def _ct_stream_opts(self, downloader, time_span):
+        return {'access_urls': [dict(downloader.configs.access_config['ct']['access-url'][0])], 'provider': 'ct',
+                'output': self._out_dir + '/stream', 'tspan': time_span,
+                'user_input_config': {'input': {}, 'filters': ['Certificate Holders Statement']}}
+
+    @staticmethod
+    def _ct_page(href, month):
+        return '<html><body><div><div><div><table><tr><td><form><table></table><table></table><table><tr><td>' \
+               f'Certificate Holders Statement<a href="{href}">Report A</a>' \
+               f'<span>(Distribution Date {month})</span></td></tr></table></form></td></tr></table>' \
+               '</div></div></div></body></html>'
+
     def test_download_files_success(self):
         print('Test: FM - Testing download success')
         o_file = self._out_dir + '/fm/2018-May/LoanLevel01May2018.xml'
@@ -69,7 +290,8 @@ class TestFileDownloader(unittest.TestCase):
         session = None
         downloader = FMDownloader()
         try:
-            downloader.download_files(session, **opts)
+            with no_backoff():
+                downloader.download_files(session, **opts)
         except DownloadException as d:
             self.assertEqual('6000_FILE_DOWNLOAD_FAILED', d.cause.exception_code, 'Test failed!')
             self.assertEqual('File not available 404', d.cause.custom_message, 'Test failed!')
@@ -88,6 +310,275 @@ class TestFileDownloader(unittest.TestCase):
         except DownloadException as d:
             self.assertEqual('6001_FILE_DOWNLOAD_NO_FILE', d.exception_code, 'Test failed!')
 
+    def test_download_streams_chunks_to_file(self):
+        print('Test: Streaming download writes all chunks and removes part file')
+        o_file = self._out_dir + '/stream/report.xml'
+        os.makedirs(os.path.dirname(o_file), exist_ok=True)
+        response = FakeResponse(200, [b'<xml>', b'body', b'</xml>'], {'Content-Length': '15'})
+        FMDownloader()._download(o_file, response, chunk_size=4)
+        with open(o_file, 'rb') as f:
+            self.assertEqual(b'<xml>body</xml>', f.read())
+        self.assertFalse(os.path.isfile(o_file + '.part'))
+        self.assertTrue(response.closed)
+
+    def test_download_incomplete_body(self):
+        print('Test: Streaming download fails when body is shorter than Content-Length')
+        o_file = self._out_dir + '/stream/short.xml'
+        os.makedirs(os.path.dirname(o_file), exist_ok=True)
+        response = FakeResponse(200, [b'<xml>'], {'Content-Length': '15'})
+        with self.assertRaises(DownloadException) as d:
+            FMDownloader()._download(o_file, response)
+        self.assertEqual('Incomplete download 5 of 15 bytes', d.exception.cause.custom_message)
+        self.assertFalse(os.path.isfile(o_file))
+
+    def test_download_cancelled_below_min_byte_rate(self):
+        print('Test: Streaming download is cancelled when transfer is too slow')
+        o_file = self._out_dir + '/stream/slow.xml'
+        os.makedirs(os.path.dirname(o_file), exist_ok=True)
+        response = FakeResponse(200, [b'<xml>', b'body', b'</xml>'], {'Content-Length': '15'})
+        with self.assertRaises(DownloadException) as d:
+            FMDownloader()._download(o_file, response, min_byte_rate=10 ** 12, byte_rate_grace=0)
+        self.assertTrue(d.exception.cause.custom_message.startswith('Transfer rate'))
+        self.assertFalse(os.path.isfile(o_file + '.part'))
+
+    def test_download_files_deadline_exceeded(self):
+        print('Test: Files not started before deadline are reported and 9001 is raised')
+        session = FakeSession({'https://fm.test/late.xml': FakeResponse(200, [b'late'])})
+        download_url = DownloadUrl('https://fm.test/late.xml', self._out_dir + '/stream/late.xml', '', '2018-May')
+        access_urls = [{'download_urls': [download_url]}]
+        with self.assertRaises(DownloadException) as d:
+            FMDownloader().download_files(session, access_urls=access_urls, deadline=Deadline(0))
+        self.assertEqual('9001_DEADLINE_EXCEEDED', d.exception.exception_code)
+        self.assertEqual(['failed'], [r.status for r in access_urls[0]['download_results']])
+        self.assertIsNone(session.kwargs, 'Request should not be sent after deadline')
+
+    def test_download_files_deferred_retry(self):
+        print('Test: File failed with retry status is downloaded by deferred retry pass')
+        o_file = self._out_dir + '/stream/deferred.xml'
+        session = FakeSession({'https://fm.test/deferred.xml': [FakeResponse(503, []), FakeResponse(503, []),
+                                                                FakeResponse(503, []), FakeResponse(200, [b'ok'])]})
+        access_urls = [{'download_urls': [DownloadUrl('https://fm.test/deferred.xml', o_file, '', '2018-May')]}]
+        with mock.patch('time.sleep') as sleep:
+            FMDownloader().download_files(session, access_urls=access_urls)
+        self.assertEqual(['downloaded'], [r.status for r in access_urls[0]['download_results']])
+        self.assertEqual(3, sleep.call_count, 'Two backoff delays and one deferred delay expected')
+
+    def test_download_files_collects_results(self):
+        print('Test: Concurrent download keeps downloading after one failed file')
+        ok_file = self._out_dir + '/stream/ok.xml'
+        missing_file = self._out_dir + '/stream/missing.xml'
+        session = FakeSession({'https://fm.test/ok.xml': FakeResponse(200, [b'ok']),
+                               'https://fm.test/missing.xml': FakeResponse(404, [])})
+        access_urls = [{'download_urls': [DownloadUrl('https://fm.test/missing.xml', missing_file, '', '2018-May'),
+                                          DownloadUrl('https://fm.test/ok.xml', ok_file, '', '2018-May')]}]
+        FMDownloader().download_files(session, access_urls=access_urls, provider='fm')
+        results = access_urls[0]['download_results']
+        self.assertEqual(['File not available 404', None],
+                         [r.error.cause.custom_message if r.error else None for r in results])
+        self.assertTrue(os.path.isfile(ok_file))
+
+    def test_download_resumes_part_file(self):
+        print('Test: Partial download continues with Range request')
+        o_file = self._out_dir + '/stream/resume.xml'
+        self._write_part(o_file, b'<xml>bo', {'etag': '"v1"', 'last_modified': None})
+        response = FakeResponse(206, [b'dy</xml>'], {'Content-Range': 'bytes 7-14/15', 'ETag': '"v1"'})
+        session = FakeSession({'https://fm.test/resume.xml': response})
+        access_urls = [{'download_urls': [DownloadUrl('https://fm.test/resume.xml', o_file, '', '2018-May')]}]
+        FMDownloader().download_files(session, access_urls=access_urls)
+        self.assertEqual({'Range': 'bytes=7-', 'If-Range': '"v1"'}, session.kwargs['headers'])
+        with open(o_file, 'rb') as f:
+            self.assertEqual(b'<xml>body</xml>', f.read())
+        self.assertFalse(os.path.isfile(o_file + '.part.validators'))
+
+    def test_download_restarts_when_range_ignored(self):
+        print('Test: Partial download starts over when server sends full file')
+        o_file = self._out_dir + '/stream/changed.xml'
+        self._write_part(o_file, b'<old>', {'etag': '"v1"', 'last_modified': None})
+        response = FakeResponse(200, [b'<xml>new</xml>'], {'Content-Length': '14', 'ETag': '"v2"'})
+        session = FakeSession({'https://fm.test/changed.xml': response})
+        access_urls = [{'download_urls': [DownloadUrl('https://fm.test/changed.xml', o_file, '', '2018-May')]}]
+        FMDownloader().download_files(session, access_urls=access_urls)
+        with open(o_file, 'rb') as f:
+            self.assertEqual(b'<xml>new</xml>', f.read())
+
+    def test_download_restarts_when_range_rejected(self):
+        print('Test: Partial download starts over when server rejects the range with 416')
+        o_file = self._out_dir + '/stream/complete.xml'
+        self._write_part(o_file, b'<xml>done</xml>', {'etag': '"v1"', 'last_modified': None})
+        session = FakeSession({'https://fm.test/complete.xml': [
+            FakeResponse(416, [], {'Content-Range': 'bytes */15'}),
+            FakeResponse(200, [b'<xml>done</xml>'], {'Content-Length': '15', 'ETag': '"v1"'})]})
+        access_urls = [{'download_urls': [DownloadUrl('https://fm.test/complete.xml', o_file, '', '2018-May')]}]
+        FMDownloader().download_files(session, access_urls=access_urls)
+        self.assertEqual({}, session.kwargs['headers'], 'Second request should not have Range')
+        self.assertEqual(['downloaded'], [r.status for r in access_urls[0]['download_results']])
+        with open(o_file, 'rb') as f:
+            self.assertEqual(b'<xml>done</xml>', f.read())
+        self.assertFalse(os.path.isfile(o_file + '.part.validators'))
+
+    def test_download_keeps_part_when_resume_fails_with_retry_status(self):
+        print('Test: Partial download is kept when server is unavailable, retry status is not a rejected range')
+        o_file = self._out_dir + '/stream/unavailable.xml'
+        self._write_part(o_file, b'<xml>', {'etag': '"v1"', 'last_modified': None})
+        session = FakeSession({'https://unavailable.test/unavailable.xml': FakeResponse(503, [])})
+        access_urls = [{'download_urls': [DownloadUrl('https://unavailable.test/unavailable.xml', o_file, '',
+                                                      '2018-May')]}]
+        with no_backoff(attempts=1):
+            with self.assertRaises(DownloadException) as raised:
+                FMDownloader().download_files(session, access_urls=access_urls)
+        self.assertTrue(RetryPolicy.transient(raised.exception), 'Retry status should stay transient')
+        self.assertEqual('bytes=5-', session.kwargs['headers']['Range'])
+        with open(o_file + '.part', 'rb') as f:
+            self.assertEqual(b'<xml>', f.read())
+        self.assertTrue(os.path.isfile(o_file + '.part.validators'))
+
+    def test_download_files_revalidates_manifest_entries(self):
+        print('Test: Files recorded in download manifest are revalidated with recorded validators')
+        out_dir = self._out_dir + '/stream'
+        download_url = DownloadUrl('https://fm.test/once.xml', out_dir + '/once.xml', '', '2018-May')
+        session = FakeSession({'https://fm.test/once.xml': FakeResponse(200, [b'once'], {'ETag': '"m1"'})})
+        FMDownloader().download_files(session, access_urls=[{'download_urls': [download_url]}], provider='fm',
+                                      output=out_dir)
+        access_urls = [{'download_urls': [download_url]}]
+        session = FakeSession({'https://fm.test/once.xml': FakeResponse(304, [])})
+        FMDownloader().download_files(session, access_urls=access_urls, provider='fm', output=out_dir)
+        self.assertEqual({'If-None-Match': '"m1"'}, session.kwargs['headers'])
+        self.assertEqual('skipped', access_urls[0]['download_results'][0].status)
+
+        session = FakeSession({'https://fm.test/once.xml': FakeResponse(200, [b'twice'], {'ETag': '"m2"'})})
+        FMDownloader().download_files(session, access_urls=access_urls, provider='fm', output=out_dir)
+        self.assertEqual('downloaded', access_urls[0]['download_results'][0].status, 'Changed file is downloaded')
+        with open(download_url.out_file, 'rb') as f:
+            self.assertEqual(b'twice', f.read())
+
+    def test_download_files_skips_immutable_manifest_entries(self):
+        print('Test: Files of immutable provider recorded in download manifest are not requested again')
+        out_dir = self._out_dir + '/stream'
+        download_url = DownloadUrl('https://fm.test/fixed.xml', out_dir + '/fixed.xml', '', '2018-May')
+        downloader = FMDownloader()
+        with mock.patch.dict(downloader.configs.access_config['fm']['download'], {'immutable': True}):
+            session = FakeSession({'https://fm.test/fixed.xml': FakeResponse(200, [b'fixed'])})
+            downloader.download_files(session, access_urls=[{'download_urls': [download_url]}], provider='fm',
+                                      output=out_dir)
+            access_urls = [{'download_urls': [download_url]}]
+            downloader.download_files(FakeSession({}), access_urls=access_urls, provider='fm', output=out_dir)
+        self.assertEqual('skipped', access_urls[0]['download_results'][0].status)
+
+    def test_download_not_modified(self):
+        print('Test: Downloaded file is revalidated with conditional request')
+        o_file = self._out_dir + '/stream/static.xml'
+        os.makedirs(os.path.dirname(o_file), exist_ok=True)
+        with open(o_file, 'wb') as f:
+            f.write(b'static')
+        ValidatorCache().store('https://fm.test/static.xml', {'ETag': '"s1"'})
+        session = FakeSession({'https://fm.test/static.xml': FakeResponse(304, [])})
+        access_urls = [{'download_urls': [DownloadUrl('https://fm.test/static.xml', o_file, '', '2018-May')]}]
+        FMDownloader().download_files(session, access_urls=access_urls)
+        self.assertEqual({'If-None-Match': '"s1"'}, session.kwargs['headers'])
+        self.assertEqual('skipped', access_urls[0]['download_results'][0].status)
+
+    def _write_part(self, o_file, content, validators):
+        os.makedirs(os.path.dirname(o_file), exist_ok=True)
+        with open(o_file + '.part', 'wb') as f:
+            f.write(content)
+        with open(o_file + '.part.validators', 'w') as f:
+            json.dump(validators, f)
+
+
+class FakeSession:
+    """Session returning prepared responses by url (list of responses for repeated requests), keeps keyword arguments
+    of the last request"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.kwargs = None
+
+    def get(self, url, **kwargs):
+        self.kwargs = kwargs
+        response = self.responses[url]
+        return response.pop(0) if isinstance(response, list) else response
+
+    def post(self, url, **kwargs):
+        return self.get(url, **kwargs)
+
+
+class PageSession:
+    """Session returning page with requested cusip (or last part of url) after short delay, counts concurrent
+    requests"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        Response = namedtuple('Response', 'status_code history url content')
+        value = params['cusip'] if params and 'cusip' in params else url.rsplit('/', 1)[1]
+        return Response(200, [], url, f'<html><body><p>{value}</p></body></html>'.encode())
+
+
+class BonySession:
+    """Bony portal session, every POST must carry csrfKey of the previous response of the same session, used keys are
+    rejected"""
+
+    def __init__(self, session_id, fail_reports=False, report_pages=0):
+        self.session_id = session_id
+        self.fail_reports = fail_reports
+        self.report_pages = report_pages
+        self.csrf_key = session_id + '-0'
+        self.requests = 0
+        self.records_per_page = set()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, **kwargs):
+        with self.lock:
+            if data['csrfKey'] != self.csrf_key:
+                raise AssertionError(f'csrfKey {data["csrfKey"]} is not the last key of session {self.session_id}')
+            if self.fail_reports and data['_Event'] == 'DEAL.DealReports':
+                raise ValueError('Deal not found')
+            self.requests += 1
+            self.csrf_key = f'{self.session_id}-{self.requests}'
+            csrf_key = self.csrf_key
+        nav_form = f'<form name="NavForm"><input name="csrfKey" value="{csrf_key}"/>'
+        if data['_Event'] == 'Search.SearchDeal':
+            page = f'{nav_form}</form><table id="FirstLevelDataTable"><tbody><tr><td>' \
+                   f'<input name="cb_cls_id" value="{data["hd_search_for"]}~1"/></td></tr></tbody></table>'
+        else:
+            self.records_per_page.add(data.get('hd_records_per_page'))
+            page = f'<table><tr><td class="PageTitle">Deal {data["hd_deal_number"]}</td></tr></table>{nav_form}' \
+                   f'<input name="HD_DEAL_NUMBER" value="{data["hd_deal_number"]}"/>' \
+                   f'<input name="hd_total_pages" value="{self.report_pages}"/></form><table ' \
+                   f'id="FirstLevelDataTable"><tbody><tr><td>page {data.get("hd_page_number", "1")}</td></tr>' \
+                   f'</tbody></table>'
+        Response = namedtuple('Response', 'status_code history url content')
+        return Response(200, [], url, f'<html><body>{page}</body></html>'.encode())
+
+    def close(self):
+        self.closed = True
+
+
+class FakeResponse:
+    """Minimal streamed response used to test downloads without network"""
+
+    def __init__(self, status_code, chunks, headers=None):
+        self.status_code = status_code
+        self.chunks = chunks
+        self.headers = headers if headers else {}
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
 
 if __name__ == "__main__":
     unittest.main()  # run all tests
@@ -3,6 +3,7 @@ import unittest
 
 from common.utils import Utils
 from file_retriever import FileRetriever
+from tests import no_backoff
 
 
 class TestFileRetriever(unittest.TestCase):
@@ -18,6 +19,9 @@ class TestFileRetriever(unittest.TestCase):
         except FileNotFoundError:
             os.mkdir(self._out_dir)
         print(f'Test files download dir : {self._out_dir}')
+        patcher = no_backoff()
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         print('::::::::::: Deleting all downloaded files :::::::::::')
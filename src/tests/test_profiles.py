@@ -1,7 +1,17 @@
 import os
+import subprocess
+import sys
 import unittest
+from unittest import mock
 
+from common.download_exceptions import DownloadException
+from common.session_registry import SessionRegistry
+from download import processor
+from download.downloader_registry import DownloaderRegistry
+from download.wf_downloader import WFDownloader
+import file_retriever
 from file_retriever import FileRetriever
+from tests import no_backoff
 
 
 class TestFileRetriever(unittest.TestCase):
@@ -16,6 +26,9 @@ class TestFileRetriever(unittest.TestCase):
         except FileNotFoundError:
             os.mkdir(self._out_dir)
         print(f'Test files download dir : {self._out_dir}')
+        patcher = no_backoff()
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         print('::::::::::: Deleting all downloaded files :::::::::::')
@@ -37,6 +50,72 @@ class TestFileRetriever(unittest.TestCase):
         opts['profile'] = 'wf'
         self.ret.retrieve(**opts)
 
+    def test_profile_parallel_collects_failures(self):
+        print('Test: Parallel profile keeps processing providers after a failure')
+
+        def fake_process(**opts):
+            if opts['provider'] == 'ct':
+                raise DownloadException('3000_ACCESS_FAILED')
+            return opts
+
+        opts = dict(self.arg_dict, profile='mark', workers=2)
+        with mock.patch.object(processor, 'process', side_effect=fake_process):
+            result = self.ret.retrieve(**opts)
+        self.assertEqual(['ubn'], list(result.succeeded))
+        self.assertEqual('3000_ACCESS_FAILED', result.failed['ct'].exception_code)
+
+    def test_main_exits_with_failure_status(self):
+        print('Test: Commandline profile run exits with status 1 when a provider failed')
+        result = processor.ProfileResult('mark', {'ubn': {}}, {'ct': DownloadException('3000_ACCESS_FAILED')})
+        with mock.patch.object(sys, 'argv', ['file_retriever', '-p', 'mark', '-o', self._out_dir]), \
+                mock.patch.object(FileRetriever, 'retrieve', return_value=result):
+            with self.assertRaises(SystemExit) as e:
+                file_retriever.main()
+        self.assertEqual(1, e.exception.code)
+
+    def test_providers_on_same_portal_share_session(self):
+        print('Test: WF providers login once and share the session')
+        session = mock.Mock()
+        registry = SessionRegistry()
+        stages = ['access', 'parse', 'filter', 'download_files', 'file_transfer']
+        with mock.patch.object(WFDownloader, 'authenticate', return_value=(session, None)) as authenticate, \
+                mock.patch.multiple(WFDownloader, **{stage: mock.DEFAULT for stage in stages}):
+            for provider in ['wf-wffm', 'wf-ry', 'wf-wfeu']:
+                processor.process(**dict(self.arg_dict, provider=provider, session_registry=registry))
+        authenticate.assert_called_once()
+        session.close.assert_not_called()
+        registry.close()
+        session.close.assert_called_once()
+
+    def test_access_failure_discards_cached_session(self):
+        print('Test: Access failure on session deletes it from session cache')
+        session = mock.Mock()
+        with mock.patch.object(WFDownloader, 'authenticate', return_value=(session, None)), \
+                mock.patch.object(WFDownloader, 'access', side_effect=DownloadException('3000_ACCESS_FAILED')), \
+                mock.patch.object(WFDownloader, 'discard_cached_session') as discard:
+            with self.assertRaises(DownloadException):
+                processor.process(**dict(self.arg_dict, provider='wf-wffm'))
+        discard.assert_called_once_with('wf-wffm', session)
+
+    def test_unknown_provider(self):
+        with self.assertRaises(DownloadException) as d:
+            DownloaderRegistry().create('unknown')
+        self.assertEqual('1001_INVALID_PROVIDER', d.exception.exception_code)
+
+    def test_registered_plugin_downloader(self):
+        registry = DownloaderRegistry()
+        registry.register('wf-new', 'download.wf_downloader:WFDownloader')
+        self.assertIs(WFDownloader, registry.get('wf-new'))
+
+    def test_fm_does_not_import_page_parsers(self):
+        print('Test: FM downloader is created without lxml and bs4')
+        code = 'import sys; from download.processor import _get_downloader_obj; _get_downloader_obj("fm"); ' \
+               'print(sorted(m for m in ("lxml", "bs4", "html5lib") if m in sys.modules))'
+        src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([src_dir, os.path.dirname(src_dir)]))
+        output = subprocess.run([sys.executable, '-c', code], cwd=src_dir, env=env, capture_output=True, text=True)
+        self.assertEqual('[]', output.stdout.strip(), output.stderr)
+
 
 if __name__ == "__main__":
     unittest.main()  # run all tests
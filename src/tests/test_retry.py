@@ -0,0 +1,117 @@
+import time
+import unittest
+import uuid
+from unittest import mock
+
+import requests
+
+from common.download_exceptions import DownloadException
+from common.rate_limiter import RateLimiter
+from common.retry import CircuitBreaker, RetryPolicy
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        """Call before every test case."""
+        self.retry = RetryPolicy({'backoff': 0, 'jitter': 0, 'failure-threshold': 2, 'reset-timeout': 60})
+        # every test has own portal host, circuit breakers are shared by the run
+        self.url = f'https://{uuid.uuid4().hex}.test/report.xml'
+
+    def test_retry_status_then_success(self):
+        send = mock.Mock(side_effect=[FakeResponse(503), FakeResponse(200)])
+        self.assertEqual(200, self.retry.call(send, 'GET').status_code)
+        self.assertEqual(2, send.call_count)
+
+    def test_post_not_retried(self):
+        send = mock.Mock(side_effect=[FakeResponse(503), FakeResponse(200)])
+        self.assertEqual(503, self.retry.call(send, 'POST').status_code)
+        self.assertEqual(1, send.call_count, 'POST with one time values should not be repeated')
+
+    def test_post_retried_when_connection_not_opened(self):
+        send = mock.Mock(side_effect=[requests.ConnectTimeout(), FakeResponse(200)])
+        self.assertEqual(200, self.retry.call(send, 'POST').status_code)
+
+    def test_attempts_exhausted(self):
+        send = mock.Mock(side_effect=requests.ConnectionError('reset'))
+        with self.assertRaises(requests.ConnectionError):
+            RetryPolicy({'backoff': 0, 'attempts': 3}).call(send, 'GET')
+        self.assertEqual(3, send.call_count)
+
+    def test_circuit_opens_for_host(self):
+        send = mock.Mock(side_effect=requests.ConnectionError('refused'))
+        with self.assertRaises(DownloadException) as d:
+            self.retry.call(send, 'GET', self.url)
+        self.assertEqual('3001_CIRCUIT_OPEN', d.exception.exception_code)
+        self.assertEqual(2, send.call_count, 'Third attempt should not be sent to portal after two failures')
+        with self.assertRaises(DownloadException):
+            self.retry.call(send, 'GET', self.url)
+        self.assertEqual(2, send.call_count, 'Open circuit should fail without request')
+
+    def test_circuit_half_open_success_closes(self):
+        breaker = CircuitBreaker.for_url(self.url, {'failure-threshold': 1, 'reset-timeout': 0})
+        breaker.failure()
+        send = mock.Mock(return_value=FakeResponse(200))
+        self.assertEqual(200, self.retry.call(send, 'GET', self.url).status_code)
+        self.assertIsNone(breaker._opened_at)
+
+    def test_circuit_half_open_throttled_closes(self):
+        breaker = CircuitBreaker.for_url(self.url, {'failure-threshold': 1, 'reset-timeout': 0})
+        breaker.failure()
+        send = mock.Mock(side_effect=[FakeResponse(429), FakeResponse(200)])
+        self.assertEqual(200, self.retry.call(send, 'GET', self.url).status_code)
+        self.assertFalse(breaker._trial, 'Trial slot should be freed by 429 response')
+        self.assertIsNone(breaker._opened_at)
+
+    def test_transient_errors(self):
+        self.assertTrue(RetryPolicy.transient(DownloadException('6000_FILE_DOWNLOAD_FAILED', requests.Timeout())))
+        self.assertFalse(RetryPolicy.transient(DownloadException('6000_FILE_DOWNLOAD_FAILED',
+                                                                 custom_message='File not available 404')))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_limiters_from_access_config(self):
+        self.assertIsNotNone(RateLimiter.for_url('https://ubn1.com/portal/login.do'))
+        self.assertIs(RateLimiter.for_url('https://ubn.com/TIR/portfolios'),
+                      RateLimiter.for_url('https://ubn.com/TIR/public/dealList/search'))
+        self.assertIsNone(RateLimiter.for_url('https://www.fm.com/wp-content/uploads/Pool01'))
+
+    def test_token_bucket_rate(self):
+        limiter = RateLimiter('rate.test', requests_per_second=20, burst=2)
+        started = time.monotonic()
+        for _ in range(4):
+            with limiter.slot():
+                pass
+        self.assertGreaterEqual(time.monotonic() - started, 0.09, 'Two requests over burst should wait 1/20s each')
+
+    def test_max_in_flight(self):
+        limiter = RateLimiter('in-flight.test', max_in_flight=1)
+        with limiter.slot():
+            self.assertFalse(limiter._in_flight.acquire(blocking=False))
+
+    def test_retry_after_pauses_host(self):
+        limiter = RateLimiter('throttled.test')
+        limiter.observe(FakeResponse(429, {'Retry-After': '0.2'}))
+        self.assertIsNone(RateLimiter.retry_after('soon'))
+        limiter.observe(FakeResponse(429, {'Retry-After': '1'}))
+        with mock.patch('time.sleep', side_effect=InterruptedError) as sleep:
+            with self.assertRaises(InterruptedError):
+                with limiter.slot():
+                    pass
+        self.assertGreater(sleep.call_args.args[0], 0.5)
+
+
+class FakeResponse:
+    """Response with status code and headers only"""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers if headers else {}
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
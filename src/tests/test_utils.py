@@ -2,8 +2,16 @@ import datetime
 import os
 import shutil
 import unittest
+from collections import namedtuple
+from unittest import mock
 
+from common.download_exceptions import DownloadException
+from common.http_client import HttpClient
+from common.probe import Prober
+from common.retry import RetryPolicy
 from common.utils import Utils
+from common.xpath_registry import XPathRegistry
+from tests import no_backoff
 
 
 class TestUtils(unittest.TestCase):
@@ -13,6 +21,9 @@ class TestUtils(unittest.TestCase):
         self.utils = Utils()
         self._out_dir = os.getcwd() + '/temp/'
         self._teardown_flag = False
+        patcher = no_backoff()
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self):
         if self._teardown_flag:
@@ -37,6 +48,26 @@ class TestUtils(unittest.TestCase):
         actual_html = self.utils.format_html(input_html)
         self.assertEqual(expected_html, actual_html, 'Actual html source did not match with expected html source')
 
+    def test_html_tree_adds_tbody(self):
+        input_html = b'<html><body><table><tr><td>test</td><td></tr></table></body></html>'
+        tree = self.utils.html_tree(input_html)
+        self.assertEqual(['test'], tree.xpath('body/table/tbody/tr/td/text()'), 'Table rows are not in tbody')
+
+    def test_html_tree_html5lib_parser(self):
+        input_html = '<html><body><table><tr><td>test</td></tr></table></body></html>'
+        tree = self.utils.html_tree(input_html, 'html5lib')
+        self.assertEqual(['test'], [td.strip() for td in tree.xpath('body/table/tbody/tr/td/text()')])
+
+    def test_xpath_registry_compiles_once(self):
+        registry = XPathRegistry()
+        self.assertIs(registry.get('td[6]/text()'), registry.get('td[6]/text()'), 'XPath compiled again')
+
+    def test_xpath_registry_invalid_config_xpath(self):
+        access_config = {'ct': {'access-url': [{'xpath': ['body/table[']}]}}
+        with self.assertRaises(DownloadException) as d:
+            XPathRegistry().compile_access_config(access_config)
+        self.assertEqual('1000_VALIDATION_FAILED', d.exception.exception_code)
+
     def test_date_range_one_month(self):
         in_date = '11/2018'
         expected_result = [datetime.datetime.strptime('01/11/2018', "%d/%m/%Y")]
@@ -86,6 +117,55 @@ class TestUtils(unittest.TestCase):
         actual_status = self.utils.is_url_exist(in_url)
         self.assertFalse(actual_status, 'URl is exist')
 
+    def test_probe_head(self):
+        session = FakeProbeSession({'HEAD': (200, {'Content-Length': '2048', 'ETag': '"p1"'})})
+        probe = Prober(session).probe('https://fm.test/LoanLevel01May2018.xml')
+        self.assertTrue(probe.exists)
+        self.assertEqual(('"p1"', 2048), (probe.etag, probe.content_length))
+        self.assertEqual(['HEAD'], session.methods)
+
+    def test_probe_ranged_get_when_head_rejected(self):
+        session = FakeProbeSession({'HEAD': (405, {}), 'GET': (206, {'Content-Range': 'bytes 0-0/4096'})})
+        probe = Prober(session).probe('https://fm.test/LoanLevel01Jun2018.xml')
+        self.assertTrue(probe.exists)
+        self.assertEqual(4096, probe.content_length)
+        self.assertEqual('bytes=0-0', session.headers['Range'])
+
+    def test_probe_missing_file(self):
+        session = FakeProbeSession({'HEAD': (404, {})})
+        self.assertFalse(Prober(session).probe('https://fm.test/LoanLevel01102018.xml').exists)
+
+    def test_probe_retry_status(self):
+        session = FakeProbeSession({'HEAD': (503, {})})
+        probe = Prober(session, RetryPolicy({'attempts': 2, 'backoff': 0})).probe('https://unavailable.test/probe.xml')
+        self.assertIsNone(probe.exists, 'Retry status should not tell that file is missing')
+        self.assertEqual(['HEAD', 'HEAD'], session.methods)
+
+    def test_http_client_provider_settings(self):
+        http_config = HttpClient().http_config('fm')
+        self.assertEqual((6, True), (http_config['pool-maxsize'], http_config['preconnect']))
+        self.assertEqual(10, HttpClient().http_config('ubn')['pool-maxsize'])
+        adapter = HttpClient().session('ubn').get_adapter('https://ubn.com/TIR/portfolios')
+        self.assertEqual((10, 60), adapter.timeout)
+
+    def test_probe_uses_provider_session(self):
+        session = FakeProbeSession({'HEAD': (200, {})})
+        with mock.patch.object(HttpClient, 'shared_session', return_value=session) as shared_session:
+            self.assertTrue(self.utils.probe('https://fm.test/LoanLevel01Jul2018.xml', provider='fm').exists)
+        shared_session.assert_called_once_with('fm')
+
+    def test_http_client_close_shuts_down_preconnect(self):
+        with mock.patch.object(HttpClient, '_connect'):
+            HttpClient().preconnect(['fm'])
+            executor = HttpClient()._executor
+            HttpClient().close()
+        self.assertIsNone(HttpClient()._executor)
+        self.assertTrue(executor._shutdown, 'preconnect threads should be shut down')
+
+    def test_http_client_shared_session(self):
+        self.assertIs(HttpClient().shared_session('fm'), HttpClient().shared_session('fm'))
+        self.assertIsNot(HttpClient().session('ct'), HttpClient().session('ct'))
+
     def test_validate_date_true(self):
         actual_date = self.utils.validate_date('1/1/2018', '%m/%d/%Y')
         self.assertTrue(actual_date[0], 'Date format not matching for input date')
@@ -128,5 +208,27 @@ class TestUtils(unittest.TestCase):
         self.assertFalse(self.utils.is_valid_time_span('2018/10-2018/12'), 'Valid time span')
 
 
+class FakeProbeSession:
+    """Session answering HEAD/GET with prepared status code and headers"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.methods = list()
+        self.headers = None
+
+    def head(self, url, headers=None, **kwargs):
+        return self._response('HEAD', headers)
+
+    def get(self, url, headers=None, **kwargs):
+        return self._response('GET', headers)
+
+    def _response(self, method, headers):
+        self.methods.append(method)
+        self.headers = headers
+        status_code, response_headers = self.responses[method]
+        response = namedtuple('Response', ['status_code', 'headers', 'close'])
+        return response(status_code, response_headers, lambda: None)
+
+
 if __name__ == "__main__":
     unittest.main()  # run all tests